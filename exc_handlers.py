@@ -2,7 +2,15 @@ from starlette import status
 from starlette.requests import Request
 from starlette.responses import JSONResponse
 
-from services.error import ValidationException, SQLGenerationException
+from services.error import (
+    ClientDisconnectedException,
+    QueryTimeoutException,
+    SQLGenerationException,
+    ValidationException,
+)
+
+# nginx' non-standard status for requests the client gave up on
+HTTP_499_CLIENT_CLOSED_REQUEST = 499
 
 
 def validation_exception_handler(_request: Request, exc: ValidationException):
@@ -15,3 +23,17 @@ def sql_exception_handler(_request: Request, exc: SQLGenerationException):
     return JSONResponse(
         status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, content={"message": str(exc)}
     )
+
+
+def query_timeout_exception_handler(_request: Request, exc: QueryTimeoutException):
+    return JSONResponse(
+        status_code=status.HTTP_504_GATEWAY_TIMEOUT, content={"message": str(exc)}
+    )
+
+
+def client_disconnected_exception_handler(
+    _request: Request, exc: ClientDisconnectedException
+):
+    return JSONResponse(
+        status_code=HTTP_499_CLIENT_CLOSED_REQUEST, content={"message": str(exc)}
+    )
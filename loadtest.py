@@ -0,0 +1,299 @@
+import argparse
+import datetime
+import http.client
+import json
+import os
+import pathlib
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+ROOT = pathlib.Path(__file__).resolve().parent
+
+RESOURCES = {
+    "todo": "/todo",
+    "todoslave": "/todo-slave",
+    "todoslavedetails": "/todo-slave-details",
+}
+
+DEFAULT_MIX = "list=60,detail=25,update=10,insert=5"
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies: dict[str, list[float]] = {}
+        self.errors: dict[str, int] = {}
+        self.lock_errors = 0
+        self.write_statement_times: list[float] = []
+
+    def record(self, kind: str, elapsed: float, ok: bool):
+        with self.lock:
+            self.latencies.setdefault(kind, []).append(elapsed)
+            if not ok:
+                self.errors[kind] = self.errors.get(kind, 0) + 1
+
+
+def _percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def _parse_mix(mix: str) -> list[tuple[str, int]]:
+    weights = []
+    for item in mix.split(","):
+        kind, weight = item.split("=")
+        if kind not in ("list", "detail", "update", "insert"):
+            raise SystemExit(f"unknown request kind in --mix: {kind}")
+        weights.append((kind.strip(), int(weight)))
+    return weights
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _seed(todos: int, slaves_per_todo: int):
+    from services.sharding import SHARD_COUNT, shard_engines, shard_for_id
+    from todo.model import ToDo
+    from todo_slave.model import ToDoSlave
+    from todo_slave_details.model import ToDoSlaveDetails
+
+    rnd = random.Random(42)
+    workers = ["Sam", "Ann", "Bob", "Kate", "Lee"]
+    words = ["cool", "urgent", "later", "review", "deploy", "fix", "write", "call"]
+    todo_rows = [
+        {
+            "id": i,
+            "comment": " ".join(rnd.sample(words, 3)),
+            "priority": rnd.randint(0, 5),
+            "is_main": rnd.random() < 0.2,
+            "worker_fullname": rnd.choice(workers),
+            "due_date": datetime.date(2024, 1, 1)
+            + datetime.timedelta(days=rnd.randint(0, 365)),
+            "count": rnd.randint(0, 100),
+        }
+        for i in range(1, todos + 1)
+    ]
+    # children get ids on the shard of their todo, the same sequence as an
+    # autoincrement column when there is a single shard
+    slave_rows = [
+        {
+            "id": ((todo_id - 1) * slaves_per_todo + n) * SHARD_COUNT
+            + shard_for_id(todo_id)
+            + 1,
+            "comment": " ".join(rnd.sample(words, 2)),
+            "todo_id": todo_id,
+        }
+        for todo_id in range(1, todos + 1)
+        for n in range(slaves_per_todo)
+    ]
+    details_rows = [
+        {"id": s["id"], "details": f"details {rnd.choice(words)}", "todo_slave_id": s["id"]}
+        for s in slave_rows
+    ]
+    for shard, shard_engine in enumerate(shard_engines):
+        with shard_engine.begin() as connection:
+            for table, rows in (
+                (ToDo.__table__, todo_rows),
+                (ToDoSlave.__table__, slave_rows),
+                (ToDoSlaveDetails.__table__, details_rows),
+            ):
+                rows = [row for row in rows if shard_for_id(row["id"]) == shard]
+                if rows:
+                    connection.execute(table.insert(), rows)
+
+
+def _request(kind: str, catalog: list[tuple[str, str]], todos: int):
+    todo_id = random.randint(1, todos)
+    match kind:
+        case "list":
+            prefix, q = random.choice(catalog)
+            return "GET", f"{prefix}/?{quote(q, safe='=(),*!.')}", None
+        case "detail":
+            return "GET", f"/todo/{todo_id}?{quote('q=(*, slaves(*))', safe='=(),*')}", None
+        case "update":
+            body = {"comment": f"load test {random.random()}"}
+            return "PATCH", f"/todo/{todo_id}", body
+        case "insert":
+            body = {
+                "comment": "load test",
+                "created_at": "2024-01-01T00:00:00",
+                "todo_id": todo_id,
+            }
+            return "POST", "/todo-slave/", body
+
+
+def _worker(port, deadline, schedule, weights, catalog, todos, stats: Stats):
+    kinds = [kind for kind, _ in weights]
+    cum_weights = [weight for _, weight in weights]
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    while True:
+        start_at = schedule()
+        if start_at is None or start_at >= deadline:
+            break
+        delay = start_at - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        kind = random.choices(kinds, cum_weights)[0]
+        method, url, body = _request(kind, catalog, todos)
+        started = time.perf_counter()
+        try:
+            connection.request(
+                method,
+                url,
+                body=json.dumps(body) if body is not None else None,
+                headers={"Content-Type": "application/json"},
+            )
+            response = connection.getresponse()
+            response.read()
+            ok = response.status < 400
+        except (OSError, http.client.HTTPException):
+            ok = False
+            connection.close()
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        stats.record(kind, time.perf_counter() - started, ok)
+    connection.close()
+
+
+def _instrument(stats: Stats):
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    @event.listens_for(Engine, "handle_error")
+    def _on_error(context):
+        if "database is locked" in str(context.original_exception):
+            with stats.lock:
+                stats.lock_errors += 1
+
+    # write statements include the time SQLite spent waiting for the lock
+    @event.listens_for(Engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info["write_started"] = time.perf_counter()
+
+    @event.listens_for(Engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip()[:6].upper() in ("INSERT", "UPDATE", "DELETE"):
+            elapsed = time.perf_counter() - conn.info.pop("write_started")
+            with stats.lock:
+                stats.write_statement_times.append(elapsed)
+
+
+def _report(stats: Stats, elapsed: float):
+    total = sum(len(v) for v in stats.latencies.values())
+    errors = sum(stats.errors.values())
+    print(f"\n{'kind':<8}{'count':>8}{'rps':>9}{'err%':>7}{'p50ms':>9}{'p95ms':>9}{'p99ms':>9}")
+    for kind, values in sorted(stats.latencies.items()):
+        print(
+            f"{kind:<8}{len(values):>8}{len(values) / elapsed:>9.1f}"
+            f"{100 * stats.errors.get(kind, 0) / len(values):>7.2f}"
+            f"{_percentile(values, 50) * 1000:>9.2f}"
+            f"{_percentile(values, 95) * 1000:>9.2f}"
+            f"{_percentile(values, 99) * 1000:>9.2f}"
+        )
+    all_values = [v for values in stats.latencies.values() for v in values]
+    print(
+        f"{'total':<8}{total:>8}{total / elapsed:>9.1f}"
+        f"{100 * errors / max(total, 1):>7.2f}"
+        f"{_percentile(all_values, 50) * 1000:>9.2f}"
+        f"{_percentile(all_values, 95) * 1000:>9.2f}"
+        f"{_percentile(all_values, 99) * 1000:>9.2f}"
+    )
+    writes = stats.write_statement_times
+    print(
+        f"\ndatabase lock errors: {stats.lock_errors}, write statements: {len(writes)}, "
+        f"p50 {_percentile(writes, 50) * 1000:.2f}ms "
+        f"p99 {_percentile(writes, 99) * 1000:.2f}ms"
+    )
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(
+        description="Load test the app in-process against a seeded temporary database"
+    )
+    arg_parser.add_argument("--duration", type=float, default=10.0)
+    arg_parser.add_argument("--concurrency", type=int, default=8)
+    arg_parser.add_argument(
+        "--rps", type=float, default=None, help="target rate, closed loop if omitted"
+    )
+    arg_parser.add_argument("--mix", default=DEFAULT_MIX)
+    arg_parser.add_argument("--todos", type=int, default=1000)
+    arg_parser.add_argument("--slaves-per-todo", type=int, default=3)
+    arg_parser.add_argument(
+        "--catalog", default=str(ROOT / "query_plans" / "catalog.json")
+    )
+    args = arg_parser.parse_args(argv)
+    weights = _parse_mix(args.mix)
+
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{workdir}/load.db"
+    os.environ.setdefault("SQL_ECHO", "0")
+    sys.path.insert(0, str(ROOT))
+
+    import uvicorn
+
+    from main import app
+    from services.db_services import Base
+    from services.sharding import shard_engines
+    from services.single_flight import single_flight
+
+    for shard_engine in shard_engines:
+        Base.metadata.create_all(bind=shard_engine)
+    _seed(args.todos, args.slaves_per_todo)
+    catalog = [
+        (RESOURCES[table], q)
+        for table, queries in json.loads(pathlib.Path(args.catalog).read_text()).items()
+        for q in queries
+    ]
+
+    port = _free_port()
+    server = uvicorn.Server(
+        uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning")
+    )
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+
+    stats = Stats()
+    _instrument(stats)
+    started = time.perf_counter()
+    deadline = started + args.duration
+    slot_lock = threading.Lock()
+    slot = iter(range(sys.maxsize))
+
+    def schedule():
+        if args.rps is None:
+            return time.perf_counter()
+        with slot_lock:
+            return started + next(slot) / args.rps
+
+    print(
+        f"load test: {args.duration:.0f}s, concurrency {args.concurrency}, "
+        f"{'rps %.0f' % args.rps if args.rps else 'closed loop'}, mix {args.mix}, "
+        f"{args.todos} todos in {workdir}"
+    )
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        for _ in range(args.concurrency):
+            pool.submit(
+                _worker, port, deadline, schedule, weights, catalog, args.todos, stats
+            )
+    elapsed = time.perf_counter() - started
+
+    server.should_exit = True
+    thread.join()
+    _report(stats, elapsed)
+    print(f"single flight: {single_flight.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,56 @@
 import uvicorn
 from fastapi import FastAPI
 
-from services.db_services import Base, engine
+from services.aggregates import install_aggregates
+from services.columnar import close_snapshots, install_snapshots
+from services.counting import start_statistics_refresh, stop_statistics_refresh
+from services.db_services import Base
+from services.full_text import install_search_indexes
+from services.sharding import shard_engines
+from services.write_batcher import start_write_batcher, stop_write_batcher
 from todo.views import todo_router
 from todo_slave.views import todo_slave_router
 from todo_slave_details.views import todo_slave_details_router
 from exc_handlers import (
+    ClientDisconnectedException,
+    QueryTimeoutException,
     ValidationException,
     SQLGenerationException,
+    client_disconnected_exception_handler,
+    query_timeout_exception_handler,
     validation_exception_handler,
     sql_exception_handler,
 )
 
 app = FastAPI()
+_schema_installed = False
+
+
+def install_schema():
+    # the prefork server calls this before forking, its workers skip it
+    global _schema_installed
+    if _schema_installed:
+        return
+    for shard_engine in shard_engines:
+        Base.metadata.create_all(bind=shard_engine)
+        install_search_indexes(shard_engine)
+        install_aggregates(shard_engine)
+    install_snapshots(shard_engines[0])
+    _schema_installed = True
+
+
 @app.on_event("startup")
 async def startup_event():
-    Base.metadata.create_all(bind=engine)
+    install_schema()
+    await start_write_batcher(shard_engines)
+    await start_statistics_refresh(shard_engines)
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await stop_statistics_refresh()
+    await stop_write_batcher()
+    close_snapshots()
 
 app.include_router(todo_router)
 app.include_router(todo_slave_router)
@@ -23,6 +58,10 @@ app.include_router(todo_slave_details_router)
 
 app.add_exception_handler(ValidationException, validation_exception_handler)
 app.add_exception_handler(SQLGenerationException, sql_exception_handler)
+app.add_exception_handler(QueryTimeoutException, query_timeout_exception_handler)
+app.add_exception_handler(
+    ClientDisconnectedException, client_disconnected_exception_handler
+)
 
 if __name__ == "__main__":
     uvicorn.run(app)
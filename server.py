@@ -0,0 +1,277 @@
+import argparse
+import gc
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import traceback
+
+import uvicorn
+from sqlalchemy.orm import configure_mappers
+from uvicorn.main import STARTUP_FAILURE
+
+from main import app, install_schema
+from services.db_services import engine
+from services.serialization import __serializers__
+from services.sharding import shard_engines
+
+# SIGHUP execs a fresh arbiter in place, it gets the listening socket and the
+# pids of the workers it replaces through these variables
+LISTEN_FD_ENV = "ARBITER_LISTEN_FD"
+OLD_WORKERS_ENV = "ARBITER_OLD_WORKERS"
+# workers exiting sooner than this after their start are respawned with an
+# exponential backoff, so a worker failing on startup does not spin
+MIN_WORKER_UPTIME = 5.0
+MAX_RESPAWN_BACKOFF = 30.0
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class WorkerInfo:
+    def __init__(self, index: int):
+        self.index = index
+        self.started_at = time.monotonic()
+        self.restarts = 0
+        self.quick_exits = 0
+        self.respawn_at = 0.0
+
+
+def _prewarm():
+    # Everything built here is shared copy-on-write with the forked workers:
+    # the Lark tables are compiled on import of services.query_parser,
+    # mappers and serializer inspections are resolved below.
+    configure_mappers()
+    for serializer in __serializers__.values():
+        serializer.get_model_inspection()
+    # the DDL runs once here, workers starting together on a fresh database
+    # would race on it
+    install_schema()
+    # no connection may cross the fork, every worker opens its own
+    for bind in {engine, *shard_engines}:
+        bind.dispose()
+    gc.collect()
+    gc.freeze()
+
+
+def _bind_socket(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _run_worker(sock: socket.socket, args) -> bool:
+    for sig in (signal.SIGHUP, signal.SIGUSR1, signal.SIGCHLD):
+        signal.signal(sig, signal.SIG_DFL)
+    for bind in {engine, *shard_engines}:
+        bind.dispose(close=False)
+    config = uvicorn.Config(app, log_level=args.log_level, access_log=False)
+    server = uvicorn.Server(config)
+    server.run(sockets=[sock])
+    # uvicorn logs a failed lifespan startup and returns
+    return server.started
+
+
+def _rss_kb(pid: int) -> int | None:
+    try:
+        with open(f"/proc/{pid}/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (OSError, ValueError):
+        return None
+
+
+class Arbiter:
+    def __init__(self, sock: socket.socket, args):
+        self.sock = sock
+        self.args = args
+        self.workers: dict[int, WorkerInfo] = {}
+        self.pending: list[WorkerInfo] = []
+        self._stopping = False
+        self._reload = False
+        self._report = False
+
+    def spawn(self, info: WorkerInfo):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                started = _run_worker(self.sock, self.args)
+            except BaseException:
+                traceback.print_exc()
+                os._exit(1)
+            os._exit(0 if started else STARTUP_FAILURE)
+        info.started_at = time.monotonic()
+        self.workers[pid] = info
+        print(f"[arbiter] worker {info.index} started, pid {pid}", flush=True)
+
+    def run(self, retire: list[int] = ()):
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+        signal.signal(signal.SIGHUP, self._on_reload)
+        signal.signal(signal.SIGUSR1, self._on_report)
+
+        for index in range(self.args.workers):
+            self.spawn(WorkerInfo(index))
+        # workers of the arbiter this one was exec'd from
+        for pid in retire:
+            self._terminate(pid)
+
+        last_report = time.monotonic()
+        while not self._stopping:
+            self.reap()
+            self.respawn()
+            if self._reload:
+                self._reload = False
+                self.reload()
+            now = time.monotonic()
+            if self._report or (
+                self.args.health_interval
+                and now - last_report >= self.args.health_interval
+            ):
+                self._report = False
+                last_report = now
+                self.report()
+            time.sleep(0.2)
+        self.stop()
+
+    def reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            info = self.workers.pop(pid, None)
+            if info is None or self._stopping:
+                continue
+            now = time.monotonic()
+            if now - info.started_at < MIN_WORKER_UPTIME:
+                info.quick_exits += 1
+            else:
+                info.quick_exits = 0
+            delay = (
+                min(MAX_RESPAWN_BACKOFF, 0.5 * 2 ** (info.quick_exits - 1))
+                if info.quick_exits
+                else 0.0
+            )
+            print(
+                f"[arbiter] worker {info.index} (pid {pid}) exited with "
+                f"status {os.waitstatus_to_exitcode(status)}, respawning"
+                f" in {delay:.1f}s",
+                flush=True,
+            )
+            info.restarts += 1
+            info.respawn_at = now + delay
+            self.pending.append(info)
+
+    def respawn(self):
+        now = time.monotonic()
+        for info in list(self.pending):
+            if info.respawn_at <= now:
+                self.pending.remove(info)
+                self.spawn(info)
+
+    def reload(self):
+        # a fresh arbiter is exec'd in this process, so new code is imported;
+        # it inherits the socket and the running workers, starts new workers
+        # and only then retires the old ones
+        # relative to the project, wherever the server was started from
+        python_path = os.pathsep.join(
+            filter(None, [PROJECT_DIR, os.environ.get("PYTHONPATH")])
+        )
+        check = subprocess.run(
+            [sys.executable, "-c", "import main"],
+            env={**os.environ, "PYTHONPATH": python_path},
+        )
+        if check.returncode != 0:
+            print("[arbiter] reload aborted, the app fails to import", flush=True)
+            return
+        print("[arbiter] graceful reload", flush=True)
+        os.environ[LISTEN_FD_ENV] = str(self.sock.fileno())
+        os.environ[OLD_WORKERS_ENV] = ",".join(map(str, self.workers))
+        os.execv(sys.executable, [sys.executable, *sys.orig_argv[1:]])
+
+    def report(self):
+        now = time.monotonic()
+        for pid, info in sorted(self.workers.items(), key=lambda w: w[1].index):
+            try:
+                os.kill(pid, 0)
+                state = "alive"
+            except ProcessLookupError:
+                state = "dead"
+            rss = _rss_kb(pid)
+            print(
+                f"[health] worker={info.index} pid={pid} state={state} "
+                f"uptime={now - info.started_at:.0f}s restarts={info.restarts} "
+                f"rss={'%dkB' % rss if rss is not None else 'n/a'}",
+                flush=True,
+            )
+
+    def stop(self):
+        print("[arbiter] shutting down", flush=True)
+        for pid in list(self.workers):
+            self._terminate(pid)
+        self.workers.clear()
+        self.pending.clear()
+
+    def _terminate(self, pid: int):
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            return
+        deadline = time.monotonic() + self.args.graceful_timeout
+        while time.monotonic() < deadline:
+            try:
+                done, _ = os.waitpid(pid, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if done:
+                return
+            time.sleep(0.05)
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+
+    def _on_stop(self, *_):
+        self._stopping = True
+
+    def _on_reload(self, *_):
+        self._reload = True
+
+    def _on_report(self, *_):
+        self._report = True
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(
+        description="Prefork server: imports the app once and forks workers"
+    )
+    arg_parser.add_argument("--host", default="127.0.0.1")
+    arg_parser.add_argument("--port", type=int, default=8000)
+    arg_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    arg_parser.add_argument("--health-interval", type=float, default=30.0)
+    arg_parser.add_argument("--graceful-timeout", type=float, default=10.0)
+    arg_parser.add_argument("--log-level", default="warning")
+    args = arg_parser.parse_args(argv)
+
+    _prewarm()
+    listen_fd = os.environ.pop(LISTEN_FD_ENV, None)
+    if listen_fd is None:
+        sock = _bind_socket(args.host, args.port)
+    else:
+        sock = socket.socket(fileno=int(listen_fd))
+        sock.set_inheritable(True)
+    retire = [int(pid) for pid in os.environ.pop(OLD_WORKERS_ENV, "").split(",") if pid]
+    print(
+        f"[arbiter] pid {os.getpid()} listening on {args.host}:{args.port} "
+        f"with {args.workers} workers (SIGHUP reload, SIGUSR1 health)",
+        flush=True,
+    )
+    Arbiter(sock, args).run(retire)
+    sock.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
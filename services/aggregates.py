@@ -0,0 +1,201 @@
+import functools
+import sys
+from typing import Type
+
+from sqlalchemy import Column, Integer, Table, text
+from sqlalchemy.orm import RelationshipDirection
+
+from services.db_services import Base
+from services.error import SQLGenerationException
+from services.serialization import AggregateField, BaseSerializer, __serializers__
+
+AGGREGATE_FUNCTIONS = ("count", "sum", "min", "max")
+
+
+def aggregate_table_name(serializer: Type[BaseSerializer]) -> str:
+    return f"{serializer.model.__tablename__}_aggregates"
+
+
+@functools.cache
+def aggregate_table(serializer: Type[BaseSerializer]) -> Table:
+    columns = []
+    for field in serializer.get_aggregate_fields():
+        if field.function not in AGGREGATE_FUNCTIONS:
+            raise SQLGenerationException(
+                f"Unsupported aggregate function: {field.function}"
+            )
+        if field.function in ("count", "sum"):
+            columns.append(
+                Column(
+                    field.field,
+                    field.type_ or Integer,
+                    nullable=False,
+                    server_default="0",
+                )
+            )
+        else:
+            columns.append(Column(field.field, field.type_ or Integer))
+    return Table(
+        aggregate_table_name(serializer),
+        Base.metadata,
+        Column("id", Integer, primary_key=True),
+        *columns,
+    )
+
+
+def aggregate_join(serializer: Type[BaseSerializer]):
+    agg = aggregate_table(serializer)
+    return serializer.model.__table__.outerjoin(
+        agg, agg.c.id == serializer.model.__table__.c.id
+    )
+
+
+def uses_aggregates(serializer: Type[BaseSerializer], names) -> bool:
+    return any(
+        field.field in names or field.alias in names
+        for field in serializer.get_aggregate_fields()
+    )
+
+
+def _relation_source(serializer: Type[BaseSerializer], relation: str):
+    sql_relation = serializer.get_model_inspection().relationships[relation]
+    if sql_relation.direction is not RelationshipDirection.ONETOMANY:
+        raise SQLGenerationException(
+            f"Aggregates need a one-to-many relation: {relation}"
+        )
+    (fk_column,) = sql_relation.remote_side
+    return sql_relation.mapper.local_table.name, fk_column.name
+
+
+def _by_relation(serializer: Type[BaseSerializer]):
+    groups: dict[str, list[AggregateField]] = {}
+    for field in serializer.get_aggregate_fields():
+        groups.setdefault(field.relation, []).append(field)
+    return groups
+
+
+def _recompute(field: AggregateField, child: str, fk: str, parent_id: str) -> str:
+    expression = f"{field.function}({field.target})"
+    if field.function in ("count", "sum"):
+        expression = f"coalesce({expression}, 0)"
+    return (
+        f"{field.field} = (SELECT {expression} FROM {child} "
+        f"WHERE {fk} = {parent_id})"
+    )
+
+
+def _on_insert(field: AggregateField) -> str:
+    match field.function:
+        case "count":
+            return f"{field.field} = {field.field} + 1"
+        case "sum":
+            return f"{field.field} = {field.field} + coalesce(new.{field.target}, 0)"
+        case "max" | "min":
+            cmp = ">" if field.function == "max" else "<"
+            return (
+                f"{field.field} = CASE WHEN {field.field} IS NULL "
+                f"OR new.{field.target} {cmp} {field.field} "
+                f"THEN new.{field.target} ELSE {field.field} END"
+            )
+
+
+def _on_delete(field: AggregateField, child: str, fk: str) -> str:
+    match field.function:
+        case "count":
+            return f"{field.field} = {field.field} - 1"
+        case "sum":
+            return f"{field.field} = {field.field} - coalesce(old.{field.target}, 0)"
+        case _:
+            return _recompute(field, child, fk, f"old.{fk}")
+
+
+def _ddl(serializer: Type[BaseSerializer]) -> list[str]:
+    parent = serializer.model.__tablename__
+    agg = aggregate_table_name(serializer)
+    statements = [
+        f"CREATE TRIGGER IF NOT EXISTS {agg}_ai AFTER INSERT ON {parent} "
+        f"BEGIN INSERT OR IGNORE INTO {agg}(id) VALUES (new.id); END",
+        f"CREATE TRIGGER IF NOT EXISTS {agg}_ad AFTER DELETE ON {parent} "
+        f"BEGIN DELETE FROM {agg} WHERE id = old.id; END",
+    ]
+    for relation, fields in _by_relation(serializer).items():
+        child, fk = _relation_source(serializer, relation)
+        ensure_new = f"INSERT OR IGNORE INTO {agg}(id) VALUES (new.{fk});"
+        inserted = (
+            f"UPDATE {agg} SET {', '.join(_on_insert(f) for f in fields)} "
+            f"WHERE id = new.{fk};"
+        )
+        deleted = (
+            f"UPDATE {agg} SET {', '.join(_on_delete(f, child, fk) for f in fields)} "
+            f"WHERE id = old.{fk};"
+        )
+        name = f"{agg}_{relation}"
+        statements += [
+            f"CREATE TRIGGER IF NOT EXISTS {name}_ai AFTER INSERT ON {child} "
+            f"WHEN new.{fk} IS NOT NULL BEGIN {ensure_new} {inserted} END",
+            f"CREATE TRIGGER IF NOT EXISTS {name}_ad AFTER DELETE ON {child} "
+            f"WHEN old.{fk} IS NOT NULL BEGIN {deleted} END",
+            # an update is a delete of the old row followed by an insert of the
+            # new one; the WHEN clauses skip the side that has no parent
+            f"CREATE TRIGGER IF NOT EXISTS {name}_au_old AFTER UPDATE ON {child} "
+            f"WHEN old.{fk} IS NOT NULL BEGIN {deleted} END",
+            f"CREATE TRIGGER IF NOT EXISTS {name}_au_new AFTER UPDATE ON {child} "
+            f"WHEN new.{fk} IS NOT NULL BEGIN {ensure_new} {inserted} END",
+        ]
+    return statements
+
+
+def _rebuild(connection, serializer: Type[BaseSerializer]):
+    parent = serializer.model.__tablename__
+    agg = aggregate_table_name(serializer)
+    connection.exec_driver_sql(f"DELETE FROM {agg}")
+    connection.exec_driver_sql(f"INSERT INTO {agg}(id) SELECT id FROM {parent}")
+    for relation, fields in _by_relation(serializer).items():
+        child, fk = _relation_source(serializer, relation)
+        assignments = ", ".join(_recompute(f, child, fk, f"{agg}.id") for f in fields)
+        connection.exec_driver_sql(f"UPDATE {agg} SET {assignments}")
+
+
+def install_aggregates(engine):
+    with engine.begin() as connection:
+        for serializer in __serializers__.values():
+            if not serializer.get_aggregate_fields():
+                continue
+            for statement in _ddl(serializer):
+                connection.exec_driver_sql(statement)
+            agg = aggregate_table_name(serializer)
+            parent = serializer.model.__tablename__
+            missing = connection.scalar(
+                text(
+                    f"SELECT count(*) FROM {parent} "
+                    f"WHERE id NOT IN (SELECT id FROM {agg})"
+                )
+            )
+            if missing:
+                # rows written before the triggers existed
+                _rebuild(connection, serializer)
+
+
+def rebuild_aggregates(engine) -> list[str]:
+    rebuilt = []
+    with engine.begin() as connection:
+        for serializer in __serializers__.values():
+            if serializer.get_aggregate_fields():
+                _rebuild(connection, serializer)
+                rebuilt.append(aggregate_table_name(serializer))
+    return rebuilt
+
+
+if __name__ == "__main__":
+    # python -m services.aggregates rebuild
+    if sys.argv[1:] != ["rebuild"]:
+        sys.exit("usage: python -m services.aggregates rebuild")
+    from main import app  # noqa: F401, registers the serializers
+    from services import aggregates
+    from services.sharding import shard_engines
+
+    for shard, shard_engine in enumerate(shard_engines):
+        Base.metadata.create_all(bind=shard_engine)
+        aggregates.install_aggregates(shard_engine)
+        for name in aggregates.rebuild_aggregates(shard_engine):
+            print(f"shard {shard}: rebuilt {name}")
@@ -0,0 +1,105 @@
+import asyncio
+import os
+import threading
+import time
+from typing import Callable
+
+from sqlalchemy import Result
+from sqlalchemy.exc import OperationalError
+from starlette.requests import Request
+
+from services.db_services import engine
+from services.error import (
+    ClientDisconnectedException,
+    QueryTimeoutException,
+    ValidationException,
+)
+
+# A read runs for at most QUERY_DEADLINE_MS (or the deadline of its route),
+# clients can ask for a shorter one with the header. The statement is aborted
+# by a SQLite progress handler once the deadline passed or the client went away.
+DEADLINE_HEADER = "x-request-deadline-ms"
+QUERY_DEADLINE_MS = int(os.environ.get("QUERY_DEADLINE_MS", "10000"))
+# SQLite VM instructions between two calls of the progress handler
+PROGRESS_HANDLER_STEPS = 10000
+DISCONNECT_POLL_INTERVAL = 0.05
+
+
+def request_timeout(request: Request, deadline_ms: int) -> float:
+    value = request.headers.get(DEADLINE_HEADER)
+    if value is None:
+        return deadline_ms / 1000
+    if not value.isdigit() or int(value) == 0:
+        raise ValidationException(f"Invalid {DEADLINE_HEADER}: {value}")
+    return min(int(value), deadline_ms) / 1000
+
+
+def _run_interruptible(bind, work: Callable, abort):
+    # a connection of its own, returned to the pool even when interrupted
+    with bind.connect() as connection:
+        dbapi_connection = connection.connection.dbapi_connection
+        dbapi_connection.set_progress_handler(abort, PROGRESS_HANDLER_STEPS)
+        try:
+            return work(connection)
+        except OperationalError as e:
+            if "interrupted" not in str(e.orig):
+                raise
+            raise QueryTimeoutException("Query exceeded its deadline")
+        finally:
+            dbapi_connection.set_progress_handler(None, PROGRESS_HANDLER_STEPS)
+
+
+async def run_interruptible(bind, work: Callable, abort):
+    # work is called with the connection, in the threadpool
+    return await asyncio.to_thread(_run_interruptible, bind, work, abort)
+
+
+async def execute_interruptible(bind, statement, abort, fetch=Result.scalar):
+    return await run_interruptible(
+        bind, lambda connection: fetch(connection.execute(statement)), abort
+    )
+
+
+def read(statement, bind=None) -> Callable:
+    # a read as taken by start_query: a coroutine function of the abort check
+    async def _run(abort):
+        return await execute_interruptible(bind or engine, statement, abort)
+
+    return _run
+
+
+def start_query(
+    run: Callable, deadline: float, cancelled: threading.Event
+) -> asyncio.Future:
+    def _abort() -> bool:
+        return cancelled.is_set() or time.monotonic() > deadline
+
+    return asyncio.ensure_future(run(_abort))
+
+
+async def wait_for_query(request: Request, query: asyncio.Future, deadline: float):
+    while not query.done():
+        await asyncio.wait({query}, timeout=DISCONNECT_POLL_INTERVAL)
+        if query.done():
+            return
+        if await request.is_disconnected():
+            raise ClientDisconnectedException("Client closed the request")
+        if time.monotonic() > deadline:
+            raise QueryTimeoutException("Query exceeded its deadline")
+
+
+async def cancellable_read(
+    request: Request, run: Callable, deadline_ms: int = QUERY_DEADLINE_MS
+):
+    deadline = time.monotonic() + request_timeout(request, deadline_ms)
+    cancelled = threading.Event()
+    query = start_query(run, deadline, cancelled)
+    try:
+        await wait_for_query(request, query, deadline)
+    except BaseException:
+        cancelled.set()
+        # respond once SQLite stopped and the connection is back in the pool
+        await asyncio.wait({query})
+        query.exception()
+        raise
+    return query.result()
@@ -0,0 +1,354 @@
+import asyncio
+import datetime
+import operator
+import os
+import threading
+from typing import Callable, Type
+
+from sqlalchemy import Boolean, Date, Integer, Result, String, select, text
+from sqlalchemy.orm import InstrumentedAttribute
+
+from services.cancellation import execute_interruptible
+from services.error import QueryTimeoutException
+from services.query_parse import get_merge_rows
+from services.query_parser import ActionTree, FilterAction, NestedField, SortOrder
+from services.serialization import BaseSerializer, __serializers__
+from services.sharding import SHARD_COUNT
+
+try:
+    import numpy as np
+except ImportError:  # optional, only needed with COLUMNAR_SNAPSHOT_ENABLED=1
+    np = None
+
+# In-memory column arrays of the serializer's snapshot_fields. List queries
+# whose filters and sort only touch those columns pick their page of ids from
+# the arrays, only the JSON of these ids is built in SQL. Every process keeps
+# its own copy and catches up from a trigger-maintained change log whenever
+# PRAGMA data_version says another connection committed.
+COLUMNAR_SNAPSHOT_ENABLED = os.environ.get("COLUMNAR_SNAPSHOT_ENABLED", "0") == "1"
+# larger pages gain nothing over plain SQL
+SNAPSHOT_MAX_ROWS = 1000
+# change log entries kept for processes that fell behind, older ones reload
+CHANGE_LOG_KEEP = 10000
+
+_COMPARISONS = (
+    operator.eq,
+    operator.ne,
+    operator.gt,
+    operator.ge,
+    operator.lt,
+    operator.le,
+)
+
+
+def change_log_name(serializer: Type[BaseSerializer]) -> str:
+    return f"{serializer.model.__tablename__}_changes"
+
+
+def _ddl(serializer: Type[BaseSerializer]) -> list[str]:
+    source = serializer.model.__tablename__
+    log = change_log_name(serializer)
+    trim = f"DELETE FROM {log} WHERE seq < (SELECT max(seq) FROM {log}) - {CHANGE_LOG_KEEP};"
+    return [
+        f"CREATE TABLE IF NOT EXISTS {log} (seq INTEGER PRIMARY KEY, id INTEGER)",
+    ] + [
+        f"CREATE TRIGGER IF NOT EXISTS {log}_{suffix} AFTER {event} ON {source} "
+        f"BEGIN INSERT INTO {log}(id) VALUES ({row}.id); {trim} END"
+        for suffix, event, row in (
+            ("ai", "INSERT", "new"),
+            ("au", "UPDATE", "new"),
+            ("ad", "DELETE", "old"),
+        )
+    ]
+
+
+class ColumnSnapshot:
+    def __init__(self, serializer: Type[BaseSerializer], engine):
+        self.serializer = serializer
+        self.engine = engine
+        self.table = serializer.model.__table__
+        self.columns = ["id", *serializer.snapshot_fields]
+        self.kinds = {}
+        for name in self.columns:
+            column_type = self.table.c[name].type
+            for kind in (Boolean, Date, String, Integer):
+                if isinstance(column_type, kind):
+                    self.kinds[name] = kind
+                    break
+            else:
+                raise TypeError(f"Column can not be snapshotted: {name}")
+        # refreshes and selections run in worker threads
+        self._lock = threading.Lock()
+        self._connection = None
+        self._data_version = None
+        self._last_seq = 0
+        self._reset()
+
+    def _reset(self):
+        self._size = 0
+        self._rows: dict[int, int] = {}
+        self._alive = np.zeros(1024, dtype=bool)
+        self._values = {name: np.zeros(1024, dtype=np.int64) for name in self.columns}
+        self._nulls = {name: np.zeros(1024, dtype=bool) for name in self.columns}
+        # strings are stored as codes into the category list
+        self._codes: dict[str, dict[str, int]] = {}
+        self._categories: dict[str, list[str]] = {}
+        self._ranks: dict[str, object] = {}
+
+    def _grow(self):
+        capacity = len(self._alive) * 2
+        self._alive = np.resize(self._alive, capacity)
+        for name in self.columns:
+            self._values[name] = np.resize(self._values[name], capacity)
+            self._nulls[name] = np.resize(self._nulls[name], capacity)
+
+    def _encode(self, name: str, value, add: bool = False):
+        match self.kinds[name]:
+            case t if t is Date:
+                return value.toordinal()
+            case t if t is String:
+                codes = self._codes.setdefault(name, {})
+                if value not in codes:
+                    if not add:
+                        return -1
+                    codes[value] = len(codes)
+                    self._categories.setdefault(name, []).append(value)
+                    self._ranks.pop(name, None)
+                return codes[value]
+            case t if t is Boolean:
+                return int(value)
+            case _:
+                return value
+
+    def _store(self, row):
+        index = self._rows.get(row.id)
+        if index is None:
+            if self._size == len(self._alive):
+                self._grow()
+            index = self._rows[row.id] = self._size
+            self._size += 1
+        self._alive[index] = True
+        for name in self.columns:
+            value = getattr(row, name)
+            self._nulls[name][index] = value is None
+            self._values[name][index] = (
+                0 if value is None else self._encode(name, value, add=True)
+            )
+
+    def _select_rows(self, connection, ids=None):
+        statement = select(*(self.table.c[name] for name in self.columns))
+        if ids is not None:
+            statement = statement.where(self.table.c.id.in_(ids))
+        return connection.execute(statement)
+
+    def load(self):
+        self._reset()
+        with self.engine.connect() as connection:
+            # changes committed after reading the log position are applied
+            # again by the next refresh
+            self._last_seq = connection.scalar(
+                text(f"SELECT coalesce(max(seq), 0) FROM {change_log_name(self.serializer)}")
+            )
+            for row in self._select_rows(connection):
+                self._store(row)
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def refresh(self):
+        with self._lock:
+            self._refresh()
+
+    def _refresh(self):
+        if self._connection is None:
+            self._connection = self.engine.connect()
+        data_version = self._connection.exec_driver_sql("PRAGMA data_version").scalar()
+        if data_version == self._data_version:
+            return
+        self._data_version = data_version
+        log = change_log_name(self.serializer)
+        with self.engine.connect() as connection:
+            first_seq, last_seq = connection.execute(
+                text(f"SELECT min(seq), max(seq) FROM {log}")
+            ).one()
+            if last_seq is None or last_seq == self._last_seq:
+                return
+            if first_seq > self._last_seq + 1 or last_seq < self._last_seq:
+                # the entries this process missed were trimmed already
+                return self.load()
+            changed = set(
+                connection.scalars(
+                    text(f"SELECT id FROM {log} WHERE seq > :first AND seq <= :last"),
+                    {"first": self._last_seq, "last": last_seq},
+                )
+            )
+            for row in self._select_rows(connection, list(changed)):
+                changed.discard(row.id)
+                self._store(row)
+            for pk in changed:
+                index = self._rows.pop(pk, None)
+                if index is not None:
+                    self._alive[index] = False
+            self._last_seq = last_seq
+
+    def _field_name(self, name: str) -> str | None:
+        for serializer_field in self.serializer.fields:
+            if name in (serializer_field.field, serializer_field.alias):
+                if serializer_field.field in self.columns:
+                    return serializer_field.field
+        return None
+
+    def _accepts(self, name: str, value) -> bool:
+        match self.kinds[name]:
+            case t if t is Date:
+                return isinstance(value, datetime.date) and not isinstance(
+                    value, datetime.datetime
+                )
+            case t if t is String:
+                return isinstance(value, str)
+            case t if t is Boolean:
+                # anything else is rejected by the Boolean bind processor
+                return isinstance(value, int) and value in (0, 1)
+            case _:
+                return isinstance(value, (int, float))
+
+    def can_serve(self, qo: ActionTree) -> bool:
+        if not qo.limit or qo.offset + qo.limit > SNAPSHOT_MAX_ROWS:
+            return False
+        for flt_item in qo.filters:
+            if isinstance(flt_item.field, NestedField):
+                return False
+            name = self._field_name(flt_item.field)
+            if name is None:
+                return False
+            if flt_item.operator is InstrumentedAttribute.in_:
+                values = flt_item.value
+            elif flt_item.operator in _COMPARISONS:
+                values = [flt_item.value]
+                if self.kinds[name] in (String, Boolean) and flt_item.operator not in (
+                    operator.eq,
+                    operator.ne,
+                ):
+                    return False
+            else:
+                return False
+            if not all(self._accepts(name, value) for value in values):
+                return False
+        return qo.sort is None or all(
+            self._field_name(key.field) is not None for key in qo.sort.keys
+        )
+
+    def _sort_key(self, name: str, rows, descending: bool):
+        values = self._values[name][rows]
+        if self.kinds[name] is String:
+            if name not in self._ranks:
+                # BINARY collation compares code points, as Python does
+                categories = self._categories.get(name, [])
+                ranks = np.empty(len(categories), dtype=np.int64)
+                ranks[np.argsort(np.array(categories, dtype=object))] = np.arange(
+                    len(categories)
+                )
+                self._ranks[name] = ranks
+            values = self._ranks[name][values]
+        key = values.astype(np.float64)
+        # SQLite puts NULLs first ascending and last descending
+        key[self._nulls[name][rows]] = -np.inf
+        return -key if descending else key
+
+    def select_ids(self, qo: ActionTree) -> tuple[list[int], int]:
+        with self._lock:
+            return self._select_ids(qo)
+
+    def _select_ids(self, qo: ActionTree) -> tuple[list[int], int]:
+        size = self._size
+        mask = self._alive[:size].copy()
+        for flt_item in qo.filters:
+            name = self._field_name(flt_item.field)
+            values = self._values[name][:size]
+            if flt_item.operator is InstrumentedAttribute.in_:
+                condition = np.isin(
+                    values, [self._encode(name, value) for value in flt_item.value]
+                )
+            else:
+                # unknown strings are encoded as -1 and match no row
+                condition = flt_item.operator(values, self._encode(name, flt_item.value))
+            mask &= condition & ~self._nulls[name][:size]
+
+        rows = np.flatnonzero(mask)
+        matched = len(rows)
+        ids = self._values["id"][rows]
+        count = qo.offset + qo.limit
+        if qo.sort is None:
+            if count < len(ids):
+                ids = ids[np.argpartition(ids, count - 1)[:count]]
+            ids = np.sort(ids)
+        else:
+            keys = [
+                self._sort_key(
+                    self._field_name(key.field), rows, key.order is SortOrder.DESC
+                )
+                for key in qo.sort.keys
+            ]
+            if count < len(ids):
+                # everything up to the count-th first key, ties included
+                first = keys[0]
+                keep = first <= np.partition(first, count - 1)[count - 1]
+                keys = [key[keep] for key in keys]
+                ids = ids[keep]
+            # lexsort sorts by its last key first, ties are returned by id
+            ids = ids[np.lexsort((ids, *reversed(keys)))]
+        return ids[qo.offset : count].tolist(), matched
+
+
+_snapshots: dict[Type[BaseSerializer], ColumnSnapshot] = {}
+
+
+def install_snapshots(engine):
+    if not COLUMNAR_SNAPSHOT_ENABLED or SHARD_COUNT > 1:
+        return
+    if np is None:
+        raise ImportError("COLUMNAR_SNAPSHOT_ENABLED=1 requires numpy")
+    for serializer in __serializers__.values():
+        if not serializer.snapshot_fields:
+            continue
+        with engine.begin() as connection:
+            for statement in _ddl(serializer):
+                connection.exec_driver_sql(statement)
+        _snapshots[serializer] = ColumnSnapshot(serializer, engine)
+        _snapshots[serializer].load()
+
+
+def close_snapshots():
+    for snapshot in _snapshots.values():
+        snapshot.close()
+    _snapshots.clear()
+
+
+def columnar_read(qo: ActionTree, serializer: Type[BaseSerializer]) -> Callable | None:
+    snapshot = _snapshots.get(serializer)
+    if snapshot is None or not snapshot.can_serve(qo):
+        return None
+
+    async def _run(abort):
+        await asyncio.to_thread(snapshot.refresh)
+        if abort():
+            raise QueryTimeoutException("Query exceeded its deadline")
+        ids, matched = await asyncio.to_thread(snapshot.select_ids, qo)
+        # the snapshot counts exactly, for estimates as well
+        total = matched if qo.count is not None else None
+        if not ids:
+            return "[]" if total is None else ("[]", total)
+        qo.filters = [FilterAction("id", InstrumentedAttribute.in_, ids)]
+        qo.sort = None
+        qo.offset = 0
+        qo.limit = None
+        rows = await execute_interruptible(
+            snapshot.engine, get_merge_rows(qo, serializer), abort, Result.all
+        )
+        json_by_id = {row.row_id: row.sql_rest for row in rows}
+        content = "[" + ",".join(json_by_id[pk] for pk in ids if pk in json_by_id) + "]"
+        return content if total is None else (content, total)
+
+    return _run
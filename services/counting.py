@@ -0,0 +1,162 @@
+import asyncio
+import copy
+import operator
+import os
+from typing import Callable, Type
+
+from sqlalchemy import select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import InstrumentedAttribute
+
+from services.query_parse import _json_query
+from services.query_parser import ActionTree, CountMode, NestedField
+from services.serialization import BaseSerializer
+
+# .count(exact) computes the total with COUNT(*) OVER () in the statement of
+# the page, .count(estimate) multiplies the row count in sqlite_stat1 by the
+# selectivity of every filter, or counts exactly until the statistics were
+# loaded. Either way it is returned in this header.
+TOTAL_COUNT_HEADER = "x-total-count"
+# sqlite_stat1 is loaded at startup and refreshed by ANALYZE this often, in
+# the background; requests only read what was loaded
+STATISTICS_TTL_SECONDS = float(os.environ.get("STATISTICS_TTL_SECONDS", "300"))
+# rows per index ANALYZE looks at, enough for an estimate
+ANALYSIS_LIMIT = 1000
+# guesses for columns without statistics, about what the SQLite planner assumes
+EQUAL_SELECTIVITY = 1 / 10
+RANGE_SELECTIVITY = 1 / 4
+DEFAULT_SELECTIVITY = 1 / 2
+
+
+class TableStatistics:
+    def __init__(self):
+        self.rows = 0
+        # average rows per value of the first column of every index
+        self.rows_per_value: dict[str, int] = {}
+
+
+_statistics: dict[object, dict[str, TableStatistics]] = {}
+_statistics_refresh: asyncio.Task | None = None
+
+
+def _analyze(connection):
+    connection.exec_driver_sql(f"PRAGMA analysis_limit={ANALYSIS_LIMIT}")
+    try:
+        connection.exec_driver_sql("ANALYZE")
+        connection.commit()
+    except OperationalError:
+        # busy writers, the statistics we have are used once more
+        connection.rollback()
+
+
+def _load_statistics(connection) -> dict[str, TableStatistics]:
+    tables: dict[str, TableStatistics] = {}
+    if connection.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'"
+    ).first() is None:
+        return tables
+    for tbl, idx, stat in connection.exec_driver_sql(
+        "SELECT tbl, idx, stat FROM sqlite_stat1"
+    ).all():
+        numbers = [int(number) for number in stat.split() if number.isdigit()]
+        table = tables.setdefault(tbl, TableStatistics())
+        table.rows = max(table.rows, numbers[0])
+        if idx is None or len(numbers) < 2:
+            continue
+        column = connection.exec_driver_sql(f'PRAGMA index_info("{idx}")').first()
+        if column is not None and column.name is not None:
+            table.rows_per_value[column.name] = numbers[1]
+    return tables
+
+
+def refresh_statistics(bind, analyze: bool = True):
+    with bind.connect() as connection:
+        if analyze:
+            _analyze(connection)
+        _statistics[bind] = _load_statistics(connection)
+
+
+async def _refresh_periodically(engines):
+    while True:
+        await asyncio.sleep(STATISTICS_TTL_SECONDS)
+        for engine in engines:
+            await asyncio.to_thread(refresh_statistics, engine)
+
+
+async def start_statistics_refresh(engines):
+    global _statistics_refresh
+    if _statistics_refresh is None:
+        # starting does not write, ANALYZE waits for the first refresh
+        for engine in engines:
+            await asyncio.to_thread(refresh_statistics, engine, False)
+        _statistics_refresh = asyncio.create_task(_refresh_periodically(engines))
+
+
+async def stop_statistics_refresh():
+    global _statistics_refresh
+    if _statistics_refresh is not None:
+        _statistics_refresh.cancel()
+        await asyncio.gather(_statistics_refresh, return_exceptions=True)
+        _statistics_refresh = None
+
+
+def table_statistics(bind, table: str) -> TableStatistics | None:
+    return _statistics.get(bind, {}).get(table)
+
+
+def _selectivity(flt_item, serializer: Type[BaseSerializer], stats) -> float:
+    if isinstance(flt_item.field, NestedField):
+        return DEFAULT_SELECTIVITY
+    column = serializer.get_field(flt_item.field)
+    if column is serializer.model.id:
+        rows_per_value = 1
+    else:
+        rows_per_value = stats.rows_per_value.get(column.key)
+    equal = rows_per_value / stats.rows if rows_per_value and stats.rows else None
+    match flt_item.operator:
+        case operator.eq:
+            return equal or EQUAL_SELECTIVITY
+        case operator.ne:
+            return 1 - (equal or EQUAL_SELECTIVITY)
+        case InstrumentedAttribute.in_:
+            return min(1.0, (equal or EQUAL_SELECTIVITY) * len(flt_item.value))
+        case operator.gt | operator.ge | operator.lt | operator.le:
+            return RANGE_SELECTIVITY
+        case _:
+            return DEFAULT_SELECTIVITY
+
+
+def estimate_total(
+    bind, qo: ActionTree, serializer: Type[BaseSerializer]
+) -> int | None:
+    stats = table_statistics(bind, serializer.model.__tablename__)
+    if stats is None:
+        return None
+    total = float(stats.rows)
+    for flt_item in qo.filters:
+        total *= _selectivity(flt_item, serializer, stats)
+    return round(total)
+
+
+def page_total(offset: int, limit, page_rows: int, estimate: Callable) -> int | None:
+    # a page that is not full ends the result, its total is exact; None when
+    # there are no statistics to estimate from, the caller counts instead
+    if (not limit or page_rows < limit) and (page_rows or not offset):
+        return offset + page_rows
+    estimated = estimate()
+    if estimated is None:
+        return None
+    if not page_rows:
+        return min(estimated, offset)
+    return max(estimated, offset + page_rows)
+
+
+def count_statement(qo: ActionTree, serializer: Type[BaseSerializer], where=()):
+    # for exact counts of pages past the end, that have no row to carry it,
+    # and estimates without statistics; built from a copy since _json_query
+    # moves nested filters to relations
+    qo = copy.deepcopy(qo)
+    qo.count = CountMode.EXACT
+    qo.offset = 0
+    qo.limit = 1
+    return select(_json_query(qo, serializer, where=where).c.total_count)
@@ -1,3 +1,5 @@
+import os
+
 from sqlalchemy.orm import declarative_base, sessionmaker
 from sqlalchemy import create_engine
 from sqlalchemy_utils import database_exists, create_database
@@ -5,12 +7,13 @@ from sqlalchemy_utils import database_exists, create_database
 
 Base = declarative_base()
 
+DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///ToDoDB.db")
+
 engine = create_engine(
-    "sqlite:///ToDoDB.db",
+    DATABASE_URL,
     connect_args={"check_same_thread": False},
-    echo=True,
+    echo=os.environ.get("SQL_ECHO", "1") == "1",
 )
-create_database(engine.url)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 session = SessionLocal()
 
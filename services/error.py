@@ -8,3 +8,11 @@ class ValidationException(RestException):
 
 class SQLGenerationException(RestException):
     ...
+
+
+class QueryTimeoutException(RestException):
+    ...
+
+
+class ClientDisconnectedException(RestException):
+    ...
@@ -0,0 +1,166 @@
+import csv
+import datetime
+import heapq
+import io
+import itertools
+from typing import Iterator, Type
+
+import orjson
+from fastapi import HTTPException
+from sqlalchemy import Boolean, Date, DateTime, Float, Integer, Numeric
+from starlette.requests import Request
+from starlette.responses import StreamingResponse
+
+from services.error import ValidationException
+from services.query_parse import get_merge_rows, get_rows, selected_columns
+from services.query_parser import parse_query
+from services.query_validation import validate_query_options
+from services.serialization import BaseSerializer
+from services.sharding import merge_key, shard_engines
+
+BATCH_SIZE = 1000
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+
+def _rows(shard_engine, statement) -> Iterator:
+    # a single cursor per shard, fetched BATCH_SIZE rows at a time
+    with shard_engine.connect() as connection:
+        result = connection.execution_options(yield_per=BATCH_SIZE).execute(
+            statement
+        )
+        yield from result
+
+
+def _batches(query_options, serializer) -> Iterator[list[str]]:
+    # every shard returns its first offset + limit rows, the page is cut
+    # from the merged stream
+    offset, limit = query_options.offset, query_options.limit
+    query_options.offset = 0
+    if limit:
+        query_options.limit = offset + limit
+    if query_options.sort is None:
+        # without order() shards are exported one after the other
+        statement = get_rows(query_options, serializer)
+        rows = itertools.chain.from_iterable(
+            _rows(shard_engine, statement) for shard_engine in shard_engines
+        )
+    else:
+        # every shard is sorted already, their cursors are merged
+        statement = get_merge_rows(query_options, serializer)
+        rows = heapq.merge(
+            *(_rows(shard_engine, statement) for shard_engine in shard_engines),
+            key=merge_key(query_options),
+        )
+    rows = itertools.islice(rows, offset, offset + limit if limit else None)
+    while batch := [row.sql_rest for row in itertools.islice(rows, BATCH_SIZE)]:
+        yield batch
+
+
+def _flatten(obj: dict, prefix: str = "", flat: dict | None = None) -> dict:
+    flat = {} if flat is None else flat
+    for key, value in obj.items():
+        if isinstance(value, dict):
+            _flatten(value, f"{prefix}{key}.", flat)
+        elif isinstance(value, list):
+            flat[prefix + key] = orjson.dumps(value).decode()
+        else:
+            flat[prefix + key] = value
+    return flat
+
+
+def _ndjson(batches) -> Iterator[str]:
+    for batch in batches:
+        yield "\n".join(batch) + "\n"
+
+
+def _csv(batches, columns: list[str]) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, columns, restval="", extrasaction="ignore")
+    writer.writeheader()
+    for batch in batches:
+        writer.writerows(_flatten(orjson.loads(row)) for row in batch)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _arrow_type(pa, column_type) -> tuple:
+    # the Arrow type of a SQL type and the conversion of its JSON value, which
+    # has booleans as 0/1 and dates as text
+    match column_type:
+        case Boolean():
+            return pa.bool_(), bool
+        case Integer():
+            return pa.int64(), int
+        case Float() | Numeric():
+            return pa.float64(), float
+        case DateTime():
+            return pa.timestamp("us"), datetime.datetime.fromisoformat
+        case Date():
+            return pa.date32(), datetime.date.fromisoformat
+        case _:
+            return pa.string(), str
+
+
+def _arrow(batches, columns: dict) -> Iterator[bytes]:
+    import pyarrow as pa
+
+    # the schema follows the selected columns, not the values of a batch
+    types = {column: _arrow_type(pa, sql_type) for column, sql_type in columns.items()}
+    schema = pa.schema(pa.field(column, types[column][0]) for column in columns)
+    sink = io.BytesIO()
+    writer = pa.ipc.new_stream(sink, schema)
+    for batch in batches:
+        rows = [_flatten(orjson.loads(row)) for row in batch]
+        for row in rows:
+            for column, (_, convert) in types.items():
+                value = row.get(column)
+                row[column] = None if value is None else convert(value)
+        writer.write_batch(pa.RecordBatch.from_pylist(rows, schema=schema))
+        yield sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+    writer.close()
+    yield sink.getvalue()
+
+
+def export_response(request: Request, serializer: Type[BaseSerializer]):
+    export_format = request.query_params.get("format", "ndjson")
+    if export_format not in EXPORT_FORMATS:
+        raise ValidationException(f"Unknown export format: {export_format}")
+    if export_format == "arrow":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise HTTPException(
+                status_code=501, detail="Arrow export requires pyarrow"
+            )
+
+    query_options = parse_query("q=" + request.query_params.get("q", "(*)"))
+    validate_query_options(query_options, serializer)
+    # an export streams every matching row, unless .limit() was given;
+    # the default page size of list queries does not apply
+    if not query_options.explicit_limit:
+        query_options.limit = None
+    columns = selected_columns(query_options, serializer)
+    batches = _batches(query_options, serializer)
+
+    match export_format:
+        case "csv":
+            content = _csv(batches, list(columns))
+        case "arrow":
+            content = _arrow(batches, columns)
+        case _:
+            content = _ndjson(batches)
+    filename = f"{serializer.model.__tablename__}.{export_format}"
+    return StreamingResponse(
+        content,
+        media_type=EXPORT_FORMATS[export_format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
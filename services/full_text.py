@@ -0,0 +1,104 @@
+import functools
+from typing import Type
+
+from sqlalchemy import column, select, table, text
+
+from services.error import SQLGenerationException
+from services.serialization import BaseSerializer, __serializers__
+
+RANK_FIELD = "rank"
+
+
+def match(_column, value):
+    # Placeholder registered in OPERATOR_SQLALCHEMY: a MATCH needs the FTS5
+    # table of the serializer, so the compiler rewrites it with match_clause.
+    raise SQLGenerationException(f"Full-text match cannot be applied to: {value}")
+
+
+def search_table_name(serializer: Type[BaseSerializer]) -> str:
+    return f"{serializer.model.__tablename__}_fts"
+
+
+@functools.cache
+def search_table(serializer: Type[BaseSerializer]):
+    return table(
+        search_table_name(serializer),
+        column("rowid"),
+        column("rank"),
+        *(column(field) for field in serializer.search_fields),
+    )
+
+
+def _search_column(serializer: Type[BaseSerializer], field: str):
+    for serializer_field in serializer.fields:
+        if field in (serializer_field.field, serializer_field.alias):
+            return search_table(serializer).c[serializer_field.field]
+    raise SQLGenerationException(f"Field is not searchable: {field}")
+
+
+def fts_query(value: str) -> str:
+    # every term becomes an FTS5 string, so "-", ":" or quotes are searched
+    # for instead of parsed as query syntax; terms are still ANDed and a
+    # trailing * still asks for a prefix
+    terms = []
+    for term in value.split():
+        prefix = len(term) > 1 and term.endswith("*")
+        if prefix:
+            term = term[:-1]
+        terms.append('"' + term.replace('"', '""') + '"' + ("*" if prefix else ""))
+    return " ".join(terms) or '""'
+
+
+def match_condition(serializer: Type[BaseSerializer], field: str, value: str):
+    return _search_column(serializer, field).op("MATCH")(fts_query(value))
+
+
+def match_clause(serializer: Type[BaseSerializer], field: str, value: str, id_column):
+    fts = search_table(serializer)
+    return id_column.in_(
+        select(fts.c.rowid).where(match_condition(serializer, field, value))
+    )
+
+
+def _ddl(serializer: Type[BaseSerializer]) -> list[str]:
+    source = serializer.model.__tablename__
+    fts = search_table_name(serializer)
+    fields = serializer.search_fields
+    columns = ", ".join(fields)
+    new_values = ", ".join(f"new.{field}" for field in fields)
+    old_values = ", ".join(f"old.{field}" for field in fields)
+    delete_old = (
+        f"INSERT INTO {fts}({fts}, rowid, {columns}) "
+        f"VALUES ('delete', old.id, {old_values});"
+    )
+    insert_new = f"INSERT INTO {fts}(rowid, {columns}) VALUES (new.id, {new_values});"
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+        f"{columns}, content='{source}', content_rowid='id')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {source} "
+        f"BEGIN {insert_new} END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {source} "
+        f"BEGIN {delete_old} END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE ON {source} "
+        f"BEGIN {delete_old} {insert_new} END",
+    ]
+
+
+def install_search_indexes(engine):
+    with engine.begin() as connection:
+        existing = set(
+            connection.scalars(
+                text("SELECT name FROM sqlite_master WHERE type = 'table'")
+            )
+        )
+        for serializer in __serializers__.values():
+            if not serializer.search_fields:
+                continue
+            fts = search_table_name(serializer)
+            for statement in _ddl(serializer):
+                connection.exec_driver_sql(statement)
+            if fts not in existing:
+                # index the rows written before the triggers existed
+                connection.exec_driver_sql(
+                    f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"
+                )
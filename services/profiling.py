@@ -0,0 +1,137 @@
+import hmac
+import os
+import time
+from typing import Type
+from urllib.parse import unquote
+
+import orjson
+from fastapi import HTTPException
+from sqlalchemy import func, select
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.sql.selectable import CTE
+from starlette.requests import Request
+from starlette.responses import Response
+
+from services.cancellation import (
+    QUERY_DEADLINE_MS,
+    cancellable_read,
+    run_interruptible,
+)
+from services.db_services import engine
+from services.error import ValidationException
+from services.query_parse import get_all
+from services.query_parser import parse_query
+from services.query_validation import validate_query_options
+from services.serialization import BaseSerializer
+from services.sharding import SHARD_COUNT
+
+# "only" returns the profile instead of the payload, any other value wraps both
+PROFILE_HEADER = "x-query-profile"
+PROFILE_TOKEN_HEADER = "x-query-profile-token"
+
+
+def _authorize(request: Request):
+    expected = os.environ.get("QUERY_PROFILE_TOKEN")
+    token = request.headers.get(PROFILE_TOKEN_HEADER, "")
+    if not expected or not hmac.compare_digest(token, expected):
+        raise HTTPException(status_code=403, detail="Query profiling not allowed")
+
+
+def explain_query_plan(connection, compiled) -> list[str]:
+    params = compiled.construct_params()
+    positional = tuple(params[name] for name in compiled.positiontup)
+    rows = connection.exec_driver_sql(
+        "EXPLAIN QUERY PLAN " + str(compiled), positional
+    ).all()
+    depth = {0: -1}
+    lines = []
+    for node_id, parent_id, _, detail in rows:
+        depth[node_id] = depth.get(parent_id, -1) + 1
+        lines.append("  " * depth[node_id] + detail)
+    return lines
+
+
+def _collect_ctes(element, level=0, found=None, seen=None) -> list[tuple[int, CTE]]:
+    found = [] if found is None else found
+    seen = set() if seen is None else seen
+    for child in element.get_children():
+        if id(child) in seen:
+            continue
+        seen.add(id(child))
+        if isinstance(child, CTE):
+            found.append((level + 1, child))
+            _collect_ctes(child.element, level + 1, found, seen)
+        else:
+            _collect_ctes(child, level, found, seen)
+    return found
+
+
+async def profile_response(
+    request: Request,
+    serializer: Type[BaseSerializer],
+    deadline_ms: int = QUERY_DEADLINE_MS,
+):
+    _authorize(request)
+    if SHARD_COUNT > 1:
+        # the profile is of one statement on one file
+        raise ValidationException("Query profiling is not available with sharding")
+    timings = {}
+
+    started = time.perf_counter()
+    query_options = parse_query(unquote(request.url.query))
+    timings["parse"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    validate_query_options(query_options, serializer)
+    timings["validate"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    q = get_all(query_options, serializer)
+    timings["build"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    compiled = q.compile(
+        dialect=sqlite.dialect(), compile_kwargs={"render_postcompile": True}
+    )
+    sql = str(compiled)
+    timings["compile"] = time.perf_counter() - started
+
+    ctes = _collect_ctes(q)
+    # the rows of every CTE, counted in a single statement
+    cte_counts = select(
+        *(select(func.count()).select_from(cte).scalar_subquery() for _, cte in ctes)
+    )
+
+    def _profile(connection):
+        started = time.perf_counter()
+        payload = connection.execute(q).scalar()
+        timings["execute"] = time.perf_counter() - started
+        counts = connection.execute(cte_counts).one() if ctes else ()
+        return payload, explain_query_plan(connection, compiled), counts
+
+    async def _run(abort):
+        return await run_interruptible(engine, _profile, abort)
+
+    # the deadline and cancellation of list reads apply to the profile as well
+    payload, plan, counts = await cancellable_read(request, _run, deadline_ms)
+    profile = {
+        "sql": sql,
+        "params": compiled.construct_params(),
+        "plan": plan,
+        "timings_ms": {
+            stage: round(elapsed * 1000, 3) for stage, elapsed in timings.items()
+        },
+        "cte_rows": [
+            {"level": level, "rows": rows}
+            for (level, _), rows in zip(ctes, counts)
+        ],
+        "rows": len(orjson.loads(payload)),
+        "response_bytes": len(payload.encode()),
+    }
+    profile_json = orjson.dumps(profile, default=str)
+    if request.headers[PROFILE_HEADER] == "only":
+        return Response(content=profile_json, media_type="application/json")
+    return Response(
+        content=b'{"profile":' + profile_json + b',"data":' + payload.encode() + b"}",
+        media_type="application/json",
+    )
@@ -1,16 +1,41 @@
-from typing import Type
+from typing import Any, Type
 
-from sqlalchemy import asc, desc, and_, select, func, case
-from sqlalchemy.orm import RelationshipDirection
+import orjson
+from sqlalchemy import asc, desc, and_, select, func, case, literal
+from sqlalchemy.orm import InstrumentedAttribute, RelationshipDirection, aliased
 
+from services.aggregates import aggregate_join, uses_aggregates
 from services.error import SQLGenerationException
-from services.query_parser import SortOrder, ActionTree, NestedField, FilterAction
-from services.serialization import BaseSerializer, get_prop_serializer
+from services.full_text import (
+    RANK_FIELD,
+    match,
+    match_clause,
+    match_condition,
+    search_table,
+)
+from services.query_parser import (
+    CountMode,
+    SortOrder,
+    ActionTree,
+    NestedField,
+    FilterAction,
+    SortAction,
+)
+from services.serialization import (
+    AggregateField,
+    BaseSerializer,
+    SerializerField,
+    get_prop_serializer,
+)
 
 EXCLUDE_COLUMN_PREFIX = "!"
 
 WILDCARD = "*"
 
+# longer in lists are bound as one JSON array and expanded by json_each, so the
+# statement has a single parameter and the same SQL for any number of values
+IN_LIST_JSON_THRESHOLD = 32
+
 
 def _debug_query(q):
     from sqlalchemy.dialects import sqlite
@@ -18,8 +43,102 @@ def _debug_query(q):
     print(q.compile(dialect=sqlite.dialect(), compile_kwargs={"literal_binds": True}))
 
 
+def _fields_to_select(
+    action: ActionTree, serializer: Type[BaseSerializer]
+) -> list[SerializerField]:
+    _model_inspect = serializer.get_model_inspection()
+    _columns = [
+        _field
+        for _field in serializer.fields
+        if _field.field not in _model_inspect.relationships
+    ]
+    if any((_field == WILDCARD for _field in action.select)):
+        _selected = _columns
+    else:
+        _selected = [
+            _field
+            for _field in _columns
+            if _field.alias in action.select or _field.field in action.select
+        ]
+    _excluded = {
+        _field[1:]
+        for _field in action.select
+        if _field.startswith(EXCLUDE_COLUMN_PREFIX)
+    }
+    return [
+        _field
+        for _field in _selected
+        if _field.alias not in _excluded and _field.field not in _excluded
+    ]
+
+
+def _used_field_names(
+    action: ActionTree, selected: list[SerializerField]
+) -> set[str]:
+    names = {field.alias for field in selected}
+    names.update(
+        flt_item.field
+        for flt_item in action.filters
+        if not isinstance(flt_item.field, NestedField)
+    )
+    if action.sort is not None:
+        names.update(
+            key.field
+            for key in action.sort.keys
+            if not isinstance(key.field, NestedField)
+        )
+    return names
+
+
+def _filter_clause(
+    flt_item: FilterAction, serializer: Type[BaseSerializer], column, id_column
+):
+    if flt_item.operator is match:
+        return match_clause(serializer, flt_item.field, flt_item.value, id_column)
+    if (
+        flt_item.operator is InstrumentedAttribute.in_
+        and len(flt_item.value) > IN_LIST_JSON_THRESHOLD
+    ):
+        values = func.json_each(literal(orjson.dumps(flt_item.value).decode()))
+        return column.in_(select(values.table_valued("value").c.value))
+    return flt_item.operator(column, flt_item.value)
+
+
+def _sort_column(field, serializer: Type[BaseSerializer], q, joined: dict):
+    # many-to-one paths are joined once, they add at most one row to every row
+    entity = serializer.model
+    path = field.fields if isinstance(field, NestedField) else [field]
+    for depth, relation_name in enumerate(path[:-1], 1):
+        relation = getattr(entity, relation_name)
+        serializer = get_prop_serializer(serializer.model, relation_name)
+        entity = joined.get(tuple(path[:depth]))
+        if entity is None:
+            entity = joined[tuple(path[:depth])] = aliased(serializer.model)
+            q = q.outerjoin(entity, relation.of_type(entity))
+    column = serializer.get_field(path[-1])
+    if entity is not serializer.model:
+        column = getattr(entity, column.key)
+    return column, q
+
+
+def _order_by(q, sort: SortAction, serializer: Type[BaseSerializer], rank_column=None):
+    columns = []
+    joined = {}
+    for key in sort.keys:
+        if key.field == RANK_FIELD and rank_column is not None:
+            column = rank_column
+        else:
+            column, q = _sort_column(key.field, serializer, q, joined)
+        columns.append(column)
+        q = q.order_by(desc(column) if key.order is SortOrder.DESC else asc(column))
+    if columns[-1] is not serializer.model.id:
+        # equal keys are ordered by id, so pages neither overlap nor skip rows
+        q = q.order_by(asc(serializer.model.id))
+    return q, columns
+
+
 def _resolve_relationships(
-    action: ActionTree, serializer: Type[BaseSerializer], id_field
+    action: ActionTree, serializer: Type[BaseSerializer], id_field, parent_pk=None
 ):
     _model_inspect = serializer.get_model_inspection()
     _fields = []
@@ -32,6 +151,7 @@ def _resolve_relationships(
             rel_serializer,
             serializer.model,
             sql_relation.primaryjoin,
+            parent_pk,
         )
         if relation_action_tree.select is not None:
             _fields.append(relation_name)
@@ -56,31 +176,31 @@ def _resolve_relationships(
     return _fields, _joins
 
 
-def _json_query(qo: ActionTree, serializer: Type[BaseSerializer]):
+def _json_query(
+    qo: ActionTree,
+    serializer: Type[BaseSerializer],
+    where=(),
+    pk=None,
+    merge_keys=False,
+):
     _fields = []
     _joins = []
     _hidden_fields_to_select = []
     _exclude_fields = []
     _model_inspect = serializer.get_model_inspection()
-    _wild_select = any((_field == "*" for _field in qo.select))
-    _field_to_select = []
-    if _wild_select:
-        _field_to_select = [
-            _field
-            for _field in serializer.fields
-            if _field not in _model_inspect.relationships
-        ]
-    for _field in qo.select:
-        if _field.startswith("!"):
-            _field_to_select.remove(_field[1:])
+    _selected = _fields_to_select(qo, serializer)
 
-    for field in _field_to_select:
-        _fields.append(field)
-        _fields.append(serializer.get_field(field))
+    for field in _selected:
+        _fields.append(field.alias)
+        _fields.append(serializer.get_field(field.field))
     if "id" not in qo.select:
         _hidden_fields_to_select.append(serializer.get_field("id"))
     _filters = []
     _inner_cte: list[str] = []
+    _rank_sort = qo.sort is not None and any(
+        key.field == RANK_FIELD for key in qo.sort.keys
+    )
+    _search_join = None
     for flt_item in qo.filters:
         if isinstance(flt_item.field, NestedField):
             if flt_item.field.fields[0] in qo.relations:
@@ -99,10 +219,27 @@ def _json_query(qo: ActionTree, serializer: Type[BaseSerializer]):
             )
             _inner_cte.append(flt_item.field.fields[0])
             continue
+        if flt_item.operator is match and _rank_sort and _search_join is None:
+            # bm25 rank is only available when joining the FTS5 table itself
+            _search_join = search_table(serializer)
+            _filters.append(
+                match_condition(serializer, flt_item.field, flt_item.value)
+            )
+            continue
         _filters.append(
-            flt_item.operator(serializer.get_field(flt_item.field), flt_item.value)
+            _filter_clause(
+                flt_item,
+                serializer,
+                serializer.get_field(flt_item.field),
+                serializer.model.id,
+            )
         )
-    rel_fields, _joins = _resolve_relationships(qo, serializer, serializer.model.id)
+    _filters.extend(where)
+    if pk is not None:
+        _filters.append(serializer.model.id == pk)
+    rel_fields, _joins = _resolve_relationships(
+        qo, serializer, serializer.model.id, pk
+    )
     _fields.extend(rel_fields)
 
     for relation_name, relation_action_tree in qo.relations.items():
@@ -118,21 +255,41 @@ def _json_query(qo: ActionTree, serializer: Type[BaseSerializer]):
             _hidden_fields_to_select.append(this_id_col)
     obj = func.json_object(*_fields)
     q = select(obj.label("sql_rest"), *_hidden_fields_to_select)
+    if uses_aggregates(serializer, _used_field_names(qo, _selected)):
+        q = q.select_from(aggregate_join(serializer))
     for join in _joins:
         match join:
             case (relation_name, cte, on_clause):
                 q = q.join(
                     cte, onclause=on_clause, isouter=relation_name not in _inner_cte
                 )
+    if _search_join is not None:
+        q = q.join(_search_join, onclause=_search_join.c.rowid == serializer.model.id)
 
     if _filters:
         q = q.filter(*_filters)
+    sort_columns = []
     if qo.sort is not None:
-        q = q.order_by(
-            asc(serializer.get_field(qo.sort.field))
-            if qo.sort.order is not SortOrder.DESC
-            else desc(serializer.get_field(qo.sort.field))
+        if _rank_sort and _search_join is None:
+            raise SQLGenerationException("Rank ordering requires a match filter")
+        q, sort_columns = _order_by(
+            q,
+            qo.sort,
+            serializer,
+            _search_join.c.rank if _search_join is not None else None,
+        )
+    if merge_keys:
+        # what rows coming from several shards are merged on
+        q = q.add_columns(
+            *(
+                column.label(f"sort_key_{index}")
+                for index, column in enumerate(sort_columns)
+            ),
+            serializer.model.id.label("row_id"),
         )
+    if qo.count is CountMode.EXACT:
+        # window functions see every row before OFFSET and LIMIT apply
+        q = q.add_columns(func.count().over().label("total_count"))
     if qo.offset:
         q = q.offset(qo.offset)
     if qo.limit:
@@ -148,6 +305,7 @@ def _relation_select(
     serializer: Type[BaseSerializer],
     parent_model,
     primaryjoin,
+    parent_pk=None,
 ):
     fields_into_json = []
     _joins = []
@@ -161,21 +319,9 @@ def _relation_select(
         other_id_col = primaryjoin.left
     has_parent_id_col = parent_id_col != serializer.model.id
     if action.select:
-        _exclude_fields = []
-
-        _wild_select = any((_field == WILDCARD for _field in action.select))
-        _field_to_select = []
-        if _wild_select:
-            _field_to_select = [
-                _field
-                for _field in serializer.fields
-                if _field not in _model_inspect.relationships
-            ]
-        for _field in action.select:
-            if _field.startswith(EXCLUDE_COLUMN_PREFIX):
-                _field_to_select.remove(_field[1:])
-
-        fld = set(serializer.get_field(field) for field in _field_to_select)
+        _field_to_select = _fields_to_select(action, serializer)
+
+        fld = set(serializer.get_field(field.field) for field in _field_to_select)
         if has_parent_id_col:
             fld.add(parent_id_col)
         for flt in action.filters:
@@ -189,18 +335,27 @@ def _relation_select(
         _field_to_select = [
             _field
             for _field in serializer.fields
-            if _field not in _model_inspect.relationships
+            if _field.field not in _model_inspect.relationships
+            and not isinstance(_field, AggregateField)
         ]
+        q = q.add_columns(
+            *{
+                serializer.get_field(flt.field)
+                for flt in action.filters
+                if not isinstance(flt.field, NestedField)
+                and uses_aggregates(serializer, {flt.field})
+            }
+        )
+    if uses_aggregates(serializer, _used_field_names(action, _field_to_select)):
+        q = q.select_from(aggregate_join(serializer))
 
     if action.sort is not None:
-        col = serializer.get_field(action.sort.field)
-        col = desc(col) if action.sort.order == SortOrder.DESC else asc(col)
-        q = q.order_by(col)
+        q, _ = _order_by(q, action.sort, serializer)
     q = q.subquery()
 
     for field in _field_to_select or []:
-        fields_into_json.append(field)
-        fields_into_json.append(q.c[field])
+        fields_into_json.append(field.alias)
+        fields_into_json.append(q.c[serializer.get_field(field.field).key])
 
     filter_items = []
     _inner_cte: list[str] = []
@@ -222,7 +377,14 @@ def _relation_select(
             )
             _inner_cte.append(flt_item.field.fields[0])
             continue
-        filter_items.append(flt_item.operator(q.c[flt_item.field], flt_item.value))
+        filter_items.append(
+            _filter_clause(
+                flt_item,
+                serializer,
+                q.c[serializer.get_field(flt_item.field).key],
+                q.c.id,
+            )
+        )
 
     relation_fields_into_json, _joins = _resolve_relationships(
         action,
@@ -251,21 +413,72 @@ def _relation_select(
             onclause=onclause,
             isouter=relation_name not in _inner_cte,
         )
+    _parent_id = parent_model.id if not has_parent_id_col else q.c[parent_id_col.name]
+    if parent_pk is not None:
+        # single record lookup: only aggregate the children of that record
+        filter_items.append(_parent_id == parent_pk)
     if filter_items:
         _cte = _cte.filter(and_(*filter_items))
-    _cte = _cte.group_by(
-        parent_model.id if not has_parent_id_col else q.c[parent_id_col.name]
-    )
+    _cte = _cte.group_by(_parent_id)
 
     return _cte.cte().prefix_with("NOT MATERIALIZED")
 
 
-def get_all(query_options: ActionTree, serializer):
+def get_all(query_options: ActionTree, serializer, where=()):
+    sub = _json_query(query_options, serializer, where=where)
     query = select(
-        "["
-        + func.coalesce(
-            func.group_concat(_json_query(query_options, serializer).c.sql_rest), ""
-        )
-        + "]"
+        "[" + func.coalesce(func.group_concat(sub.c.sql_rest), "") + "]"
     )
+    if query_options.count is not None:
+        query = query.add_columns(func.count().label("page_rows"))
+    if query_options.count is CountMode.EXACT:
+        query = query.add_columns(func.max(sub.c.total_count).label("total_count"))
     return query
+
+
+def get_rows(query_options: ActionTree, serializer):
+    return select(_json_query(query_options, serializer).c.sql_rest)
+
+
+def get_merge_rows(query_options: ActionTree, serializer, where=()):
+    sub = _json_query(query_options, serializer, where=where, merge_keys=True)
+    return select(
+        sub.c.sql_rest,
+        *(column for column in sub.c if column.name.startswith("sort_key_")),
+        sub.c.row_id,
+        *(column for column in sub.c if column.name == "total_count"),
+    )
+
+
+def selected_columns(
+    action: ActionTree, serializer: Type[BaseSerializer], prefix: str = ""
+) -> dict[str, Any]:
+    # flattened names to SQL types, None for the arrays of one-to-many relations
+    _model_inspect = serializer.get_model_inspection()
+    columns = {
+        prefix + field.alias: serializer.get_field(field.field).type
+        for field in _fields_to_select(action, serializer)
+    }
+    for relation_name, relation_action_tree in action.relations.items():
+        if relation_action_tree.select is None:
+            continue
+        sql_relation = _model_inspect.relationships[relation_name]
+        if sql_relation.direction is RelationshipDirection.MANYTOONE:
+            columns.update(
+                selected_columns(
+                    relation_action_tree,
+                    get_prop_serializer(serializer.model, relation_name),
+                    f"{prefix}{relation_name}.",
+                )
+            )
+        else:
+            columns[prefix + relation_name] = None
+    return columns
+
+
+def get_one(query_options: ActionTree, serializer, pk: int):
+    query_options.limit = None
+    query_options.offset = 0
+    query_options.sort = None
+    query_options.count = None
+    return select(_json_query(query_options, serializer, pk=pk).c.sql_rest)
@@ -1,6 +1,7 @@
 import datetime
 import enum
 import operator
+import re
 from typing import Callable, Any
 
 import lark
@@ -8,6 +9,10 @@ from lark import Transformer, Lark
 from sqlalchemy.orm import InstrumentedAttribute
 
 from services.error import ValidationException
+from services.full_text import match
+
+
+DEFAULT_QUERY = "q=(*)"
 
 
 class SortOrder(str, enum.Enum):
@@ -15,12 +20,18 @@ class SortOrder(str, enum.Enum):
     DESC = "desc"
 
 
+class CountMode(str, enum.Enum):
+    EXACT = "exact"
+    ESTIMATE = "estimate"
+
+
 # ActionTree
 #       |- select list[str]
 #       |- filter col.eq=5 | relation.sub_relation.id=4
-#       |- sort col.asc | relation.sub_relation.id.asc
-#       |- limit: int > 0
+#       |- sort [col.asc, relation.sub_relation.id.asc, ...]
+#       |- limit: int > 0, explicit_limit when given by .limit()
 #       |- offset: int >= 0
+#       |- count exact | estimate, total rows matching the filters
 #       |- relations dict[str, ActionTree]
 
 
@@ -31,7 +42,9 @@ class ActionTree:
         self.filters: list[FilterAction] = []
         self.sort: SortAction | None = None
         self.limit: int = 20
+        self.explicit_limit = False
         self.offset: int = 0
+        self.count: CountMode | None = None
         self.relations: dict[str, ActionTree] = {}
 
 
@@ -58,12 +71,17 @@ class FilterAction:
         )
 
 
-class SortAction:
-    def __init__(self, field, order: SortOrder):
+class SortKey:
+    def __init__(self, field: str | NestedField, order: SortOrder):
         self.field = field
         self.order = order
 
 
+class SortAction:
+    def __init__(self, keys: list[SortKey]):
+        self.keys = keys
+
+
 class OffsetAction:
     def __init__(self, value: int):
         self.value = value
@@ -74,6 +92,11 @@ class LimitAction:
         self.value = value
 
 
+class CountAction:
+    def __init__(self, mode: CountMode):
+        self.mode = mode
+
+
 OPERATOR_SQLALCHEMY = {
     ">=": operator.ge,
     ">": operator.gt,
@@ -85,26 +108,32 @@ OPERATOR_SQLALCHEMY = {
     "is_null": InstrumentedAttribute.is_,
     "like": InstrumentedAttribute.like,
     "ilike": InstrumentedAttribute.ilike,
+    "match": match,
 }
 
 grammar = """
     DATE.10: DIGIT+ "-" DIGIT+ "-" DIGIT+
-    ?rvalue: DATE | NUMBER | ESCAPED_STRING
+    ?rvalue: scalar | list_value
+    ?scalar: DATE | NUMBER | ESCAPED_STRING
+    list_value: "[" scalar ("," scalar)* "]"
     
     start: _root_query
     
     _root_query: "q" "=" action_tree
     
-    action_tree: "(" field ("," field) * ")" ("." filter_fn)? ("." offset_fn)? ("." limit_fn)? ("." order_fn)? 
+    action_tree: "(" field ("," field) * ")" ("." filter_fn)? ("." offset_fn)? ("." limit_fn)? ("." order_fn)? ("." count_fn)?
     
     filter_fn: "filter" "(" nested_field FILTER_OP rvalue ")"
-    FILTER_OP: "=" | ">" | "<" | ">=" | "<=" | "in" | "!=" | "is_null" | "like" | "ilike"
+    FILTER_OP: "=" | ">" | "<" | ">=" | "<=" | "in" | "!=" | "is_null" | "like" | "ilike" | "match"
     
-    order_fn: "order" "(" CNAME "," SORT_ORDER ")" 
+    order_fn: "order" "(" sort_key ("," sort_key)* ")"
+    sort_key: nested_field "," SORT_ORDER
     SORT_ORDER: "asc" | "desc"
     
     limit_fn: "limit" "(" NUMBER ")"
     offset_fn: "offset" "(" NUMBER ")"    
+    count_fn: "count" "(" COUNT_MODE ")"
+    COUNT_MODE: "exact" | "estimate"
     
     !field: "!" CNAME | CNAME | "*" | relation
     
@@ -122,6 +151,16 @@ grammar = """
 """
 
 
+def _number(value: str):
+    if "." in value:
+        return float(value)
+    return int(value)
+
+
+def _date(value: str):
+    return datetime.datetime.strptime(value, "%Y-%m-%d").date()
+
+
 class SelectQueryTransformer(Transformer):
     def start(self, items):
         return items[0]
@@ -130,7 +169,7 @@ class SelectQueryTransformer(Transformer):
         opts = ActionTree()
         for item in items:
             match item:
-                case SortAction(field=_, order=_):
+                case SortAction(keys=_):
                     opts.sort = item
                 case FilterAction(field=_, operator=_, value=_):
                     if item not in opts.filters:
@@ -139,6 +178,9 @@ class SelectQueryTransformer(Transformer):
                     opts.offset = offset_value
                 case LimitAction(value=limit_value):
                     opts.limit = limit_value
+                    opts.explicit_limit = True
+                case CountAction(mode=count_mode):
+                    opts.count = count_mode
                 case ActionTree(
                     relations=_, select=_, sort=_, filters=_, limit=_, offset=_
                 ):
@@ -159,7 +201,10 @@ class SelectQueryTransformer(Transformer):
         return FilterAction(items[0], items[1], items[2])
 
     def order_fn(self, items):
-        return SortAction(items[0], items[1])
+        return SortAction(items)
+
+    def sort_key(self, items):
+        return SortKey(items[0], items[1])
 
     def offset_fn(self, items):
         return OffsetAction(items[0])
@@ -167,19 +212,26 @@ class SelectQueryTransformer(Transformer):
     def limit_fn(self, items):
         return LimitAction(items[0])
 
+    def count_fn(self, items):
+        return CountAction(items[0])
+
     def SORT_ORDER(self, items):
         return SortOrder(items)
 
+    def COUNT_MODE(self, items):
+        return CountMode(items)
+
     def rvalue(self, items):
         return items[0]
 
+    def list_value(self, items):
+        return list(items)
+
     def NUMBER(self, items):
-        if "." in items:
-            return float(items)
-        return int(items)
+        return _number(items)
 
     def DATE(self, items):
-        return datetime.datetime.strptime(items, "%Y-%m-%d").date()
+        return _date(items)
 
     def field(self, items):
         match items[0]:
@@ -206,7 +258,161 @@ class SelectQueryTransformer(Transformer):
 parser = Lark(grammar, parser="lalr", transformer=SelectQueryTransformer())
 
 
+# Hand-written recursive descent parser for the grammar above. Every token
+# pattern mirrors the Lark terminal the contextual lexer accepts at the same
+# point, whitespace is skipped in front of each token. It only has to handle
+# well-formed queries: on any error parse_query falls back to Lark, which
+# reports it.
+_WS = r"[ \t\f\r\n]*"
+
+
+def _token(pattern: str):
+    return re.compile(f"{_WS}({pattern})").match
+
+
+_Q = _token("q")
+_EQUAL = _token("=")
+_LPAR = _token(r"\(")
+_RPAR = _token(r"\)")
+_LSQB = _token(r"\[")
+_RSQB = _token(r"\]")
+_COMMA = _token(",")
+_DOT = _token(r"\.")
+_BANG = _token("!")
+_STAR = _token(r"\*")
+_CNAME = _token("[A-Za-z_][A-Za-z_0-9]*")
+_METHOD = _token("filter|offset|limit|order|count")
+_FILTER_OP = _token("is_null|ilike|match|like|>=|<=|in|!=|=|>|<")
+_SORT_ORDER = _token("desc|asc")
+_COUNT_MODE = _token("exact|estimate")
+_DATE = _token("[0-9]+-[0-9]+-[0-9]+")
+_NUMBER = _token(
+    r"[0-9]+[eE][+-]?[0-9]+"
+    r"|(?:[0-9]+\.(?:[0-9]+)?|\.[0-9]+)(?:[eE][+-]?[0-9]+)?"
+    r"|[0-9]+"
+)
+_ESCAPED_STRING = _token(r'".*?(?<!\\)(?:\\\\)*?"')
+_END = re.compile(f"{_WS}\\Z").match
+
+_METHODS = ("filter", "offset", "limit", "order", "count")
+
+
+class _FastParseError(Exception):
+    pass
+
+
+class _FastParser:
+    __slots__ = ("text", "pos")
+
+    def __init__(self, text: str):
+        self.text = text
+        self.pos = 0
+
+    def accept(self, token) -> str | None:
+        m = token(self.text, self.pos)
+        if m is None:
+            return None
+        self.pos = m.end()
+        return m.group(1)
+
+    def expect(self, token) -> str:
+        value = self.accept(token)
+        if value is None:
+            raise _FastParseError(self.pos)
+        return value
+
+    def parse(self) -> ActionTree:
+        self.expect(_Q)
+        self.expect(_EQUAL)
+        tree = self.action_tree()
+        if _END(self.text, self.pos) is None:
+            raise _FastParseError(self.pos)
+        return tree
+
+    def action_tree(self) -> ActionTree:
+        tree = ActionTree()
+        self.expect(_LPAR)
+        self.field(tree)
+        while self.accept(_COMMA):
+            self.field(tree)
+        self.expect(_RPAR)
+
+        next_method = 0
+        while self.accept(_DOT):
+            method = _METHODS.index(self.expect(_METHOD))
+            if method < next_method:
+                raise _FastParseError(self.pos)
+            next_method = method + 1
+            self.expect(_LPAR)
+            match method:
+                case 0:
+                    field = self.nested_field()
+                    op = OPERATOR_SQLALCHEMY[self.expect(_FILTER_OP)]
+                    tree.filters.append(FilterAction(field, op, self.rvalue()))
+                case 1:
+                    tree.offset = _number(self.expect(_NUMBER))
+                case 2:
+                    tree.limit = _number(self.expect(_NUMBER))
+                    tree.explicit_limit = True
+                case 3:
+                    keys = [self.sort_key()]
+                    while self.accept(_COMMA):
+                        keys.append(self.sort_key())
+                    tree.sort = SortAction(keys)
+                case 4:
+                    tree.count = CountMode(self.expect(_COUNT_MODE))
+            self.expect(_RPAR)
+        return tree
+
+    def field(self, tree: ActionTree):
+        if self.accept(_BANG):
+            tree.select.append("!" + self.expect(_CNAME))
+        elif self.accept(_STAR):
+            tree.select.append("*")
+        else:
+            name = self.expect(_CNAME)
+            if _LPAR(self.text, self.pos) is None:
+                tree.select.append(name)
+                return
+            relation = self.action_tree()
+            relation.name = name
+            tree.relations[name] = relation
+
+    def nested_field(self) -> str | NestedField:
+        fields = [self.expect(_CNAME)]
+        while self.accept(_DOT):
+            fields.append(self.expect(_CNAME))
+        if len(fields) == 1:
+            return fields[0]
+        return NestedField(fields)
+
+    def sort_key(self) -> SortKey:
+        field = self.nested_field()
+        self.expect(_COMMA)
+        return SortKey(field, SortOrder(self.expect(_SORT_ORDER)))
+
+    def rvalue(self):
+        if self.accept(_LSQB):
+            values = [self.scalar()]
+            while self.accept(_COMMA):
+                values.append(self.scalar())
+            self.expect(_RSQB)
+            return values
+        return self.scalar()
+
+    def scalar(self):
+        if (value := self.accept(_DATE)) is not None:
+            return _date(value)
+        if (value := self.accept(_NUMBER)) is not None:
+            return _number(value)
+        return self.expect(_ESCAPED_STRING)[1:-1]
+
+
 def parse_query(q: str):
+    try:
+        return _FastParser(q).parse()
+    except (_FastParseError, KeyError, ValueError, RecursionError):
+        pass
     try:
         return parser.parse(q)
     except lark.UnexpectedToken as e:
@@ -1,11 +1,18 @@
 import operator
 from typing import Type
 
-from sqlalchemy.orm import InstrumentedAttribute
+from sqlalchemy.orm import InstrumentedAttribute, RelationshipDirection
 
 from services.error import ValidationException
+from services.full_text import RANK_FIELD, match
 from services.query_parser import ActionTree, NestedField
-from services.serialization import BaseSerializer, get_serializer
+from services.serialization import (
+    AggregateField,
+    BaseSerializer,
+    RelationField,
+    get_serializer,
+    get_prop_serializer,
+)
 
 
 def validate_query_options(qo: ActionTree, serializer: Type[BaseSerializer]):
@@ -13,6 +20,11 @@ def validate_query_options(qo: ActionTree, serializer: Type[BaseSerializer]):
         _validate_select(qo, serializer)
     if qo.filters is not None:
         _validate_filter(qo, serializer)
+    _validate_sort(qo, serializer)
+    for rel_action in qo.relations.values():
+        _validate_count(rel_action)
+    if qo.sort is not None and any(key.field == RANK_FIELD for key in qo.sort.keys):
+        _validate_rank_sort(qo)
 
 
 def _validate_select(action: ActionTree, serializer: Type[BaseSerializer]):
@@ -78,10 +90,27 @@ def _validate_filter(
                 f"Value must be string: {flt_item.value} for operator: {flt_item.operator}"
             )
 
+        if flt_item.operator is match:
+            _validate_match(flt_item.field, flt_item.value, serializer)
+
         if isinstance(flt_item.value, list) and operator.eq == flt_item.operator:
             raise ValidationException(
                 "Equal operator doesn`t support list of values, please provide single value"
             )
+        if (
+            isinstance(flt_item.value, list)
+            and InstrumentedAttribute.in_ != flt_item.operator
+        ):
+            raise ValidationException(
+                f"Only in operator supports list of values: {flt_item.value}"
+            )
+        if (
+            not isinstance(flt_item.value, list)
+            and InstrumentedAttribute.in_ == flt_item.operator
+        ):
+            raise ValidationException(
+                f"Value must be list: {flt_item.value} for operator: in"
+            )
         if (
             isinstance(flt_item.value, list)
             and InstrumentedAttribute.in_ == flt_item.operator
@@ -97,3 +126,91 @@ def _validate_filter(
         relation_type = relation_.entity
         relation_serializer = get_serializer(relation_type.entity)
         _validate_filter(rel_action, relation_serializer)
+
+
+def _validate_match(field, value, serializer: Type[BaseSerializer]):
+    if not isinstance(value, str):
+        raise ValidationException(f"Value must be string: {value} for operator: match")
+    path = field.fields if isinstance(field, NestedField) else [field]
+    for relation_name in path[:-1]:
+        if relation_name not in serializer.get_model_inspection().relationships:
+            raise ValidationException(f"Unknown relation passed: {relation_name}")
+        serializer = get_prop_serializer(serializer.model, relation_name)
+    field_aliases = {f.alias: f for f in serializer.fields}
+    if path[-1] not in field_aliases.keys():
+        raise ValidationException(f"Unknown field passed: {path[-1]}")
+    if field_aliases[path[-1]].field not in serializer.search_fields:
+        raise ValidationException(f"Field is not searchable: {path[-1]}")
+
+
+def _validate_sort(
+    action: ActionTree, serializer: Type[BaseSerializer], top_level: bool = True
+):
+    for key in action.sort.keys if action.sort is not None else []:
+        if key.field == RANK_FIELD:
+            if not top_level:
+                # the rank column only exists in the statement of the top level
+                raise ValidationException(
+                    f"Ordering by {RANK_FIELD} is only possible on the top level"
+                )
+            continue
+        path = key.field.fields if isinstance(key.field, NestedField) else [key.field]
+        sort_serializer = serializer
+        for relation_name in path[:-1]:
+            # only the relations the serializer exposes
+            field_def = next(
+                (
+                    f
+                    for f in sort_serializer.fields
+                    if isinstance(f, RelationField) and f.alias == relation_name
+                ),
+                None,
+            )
+            if field_def is None:
+                raise ValidationException(f"Unknown relation passed: {relation_name}")
+            relation = sort_serializer.get_model_inspection().relationships[
+                field_def.field
+            ]
+            if relation.direction is not RelationshipDirection.MANYTOONE:
+                # one row per related row would be sorted, not one per row
+                raise ValidationException(
+                    f"Cannot sort across a to-many relation: {relation_name}"
+                )
+            sort_serializer = get_prop_serializer(
+                sort_serializer.model, field_def.field
+            )
+        field_def = next(
+            (f for f in sort_serializer.fields if path[-1] in (f.field, f.alias)), None
+        )
+        if field_def is None or isinstance(field_def, RelationField):
+            raise ValidationException(f"Unknown field to sort by: {path[-1]}")
+        if len(path) > 1 and isinstance(field_def, AggregateField):
+            raise ValidationException(
+                f"Cannot sort by an aggregate of a related row: {path[-1]}"
+            )
+    model_inspection = serializer.get_model_inspection()
+    field_aliases = {f.alias: f for f in serializer.fields}
+    for relation_name, rel_action in action.relations.items():
+        if relation_name not in field_aliases.keys():
+            raise ValidationException(f"Unknown relation passed: {relation_name}")
+        relation_ = model_inspection.relationships[field_aliases[relation_name].field]
+        _validate_sort(
+            rel_action, get_serializer(relation_.entity.entity), top_level=False
+        )
+
+
+def _validate_count(action: ActionTree):
+    if action.count is not None:
+        raise ValidationException("Only the top level query can be counted")
+    for rel_action in action.relations.values():
+        _validate_count(rel_action)
+
+
+def _validate_rank_sort(action: ActionTree):
+    if not any(
+        flt_item.operator is match and not isinstance(flt_item.field, NestedField)
+        for flt_item in action.filters
+    ):
+        raise ValidationException(
+            f"Ordering by {RANK_FIELD} requires a match filter on the same level"
+        )
@@ -0,0 +1,174 @@
+from typing import Annotated, Optional, Type
+from urllib.parse import unquote
+
+from fastapi import APIRouter, HTTPException, Path, Request
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, create_model
+from sqlalchemy import bindparam, delete, update
+from starlette.responses import Response
+
+from services.cancellation import QUERY_DEADLINE_MS, cancellable_read, read
+from services.columnar import columnar_read
+from services.counting import TOTAL_COUNT_HEADER
+from services.db_services import session
+from services.export import export_response
+from services.profiling import PROFILE_HEADER, profile_response
+from services.query_parse import get_all, get_one
+from services.query_parser import DEFAULT_QUERY, CountMode, parse_query
+from services.query_validation import validate_query_options
+from services.serialization import BaseSerializer
+from services.sharding import (
+    SHARD_COUNT,
+    check_update_shard,
+    insert_shard,
+    counted_read,
+    insert_statement,
+    list_read,
+    shard_engine,
+    shard_engines,
+    shard_for_id,
+)
+from services.single_flight import coalesced_read
+from services.write_batcher import get_write_batcher
+
+
+async def _write(statement, params: dict, shard: int = 0):
+    write_batcher = get_write_batcher(shard)
+    if write_batcher is not None:
+        return await write_batcher.execute(statement, params)
+    try:
+        row = session.execute(
+            statement, params, bind_arguments={"bind": shard_engines[shard]}
+        ).first()
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    return row
+
+
+def _partial_model(input_model: Type[BaseModel]) -> Type[BaseModel]:
+    return create_model(
+        f"{input_model.__name__}Partial",
+        **{
+            name: (Optional[field.annotation], None)
+            for name, field in input_model.model_fields.items()
+        },
+    )
+
+
+def crud_router(
+    serializer: Type[BaseSerializer],
+    input_model: Type[BaseModel],
+    prefix: str,
+    tags: list[str],
+    children_of=None,
+    query_deadline_ms: int = QUERY_DEADLINE_MS,
+) -> APIRouter:
+    # children_of: foreign key column, when given GET /{pk} lists the rows
+    # referencing pk instead of returning the row with that primary key
+    router = APIRouter(
+        prefix=prefix,
+        tags=tags,
+        responses={404: {"description": "Not found"}},
+    )
+    partial_model = _partial_model(input_model)
+    table = serializer.model.__table__
+    insert_stmts = [insert_statement(table, shard) for shard in range(SHARD_COUNT)]
+    # SET columns are taken from the keys of the parameters of each call
+    update_stmt = (
+        update(table).where(table.c.id == bindparam("pk")).returning(*table.c)
+    )
+    delete_stmt = (
+        delete(table).where(table.c.id == bindparam("pk")).returning(table.c.id)
+    )
+
+    @router.get("/")
+    async def get_list(request: Request):
+        if PROFILE_HEADER in request.headers:
+            return await profile_response(request, serializer, query_deadline_ms)
+        query_options = parse_query(unquote(request.url.query))
+        validate_query_options(query_options, serializer)
+        content = await coalesced_read(
+            request,
+            serializer,
+            query_options,
+            lambda: columnar_read(query_options, serializer)
+            or list_read(query_options, serializer),
+            query_deadline_ms,
+        )
+        headers = None
+        if query_options.count is not None:
+            content, total = content
+            headers = {TOTAL_COUNT_HEADER: str(total)}
+        return Response(
+            content=content, media_type="application/json", headers=headers
+        )
+
+    @router.get("/export")
+    async def export(request: Request):
+        return export_response(request, serializer)
+
+    @router.get("/{pk}")
+    async def get_by_id(pk: Annotated[int, Path(ge=0)], request: Request):
+        query_options = parse_query(unquote(request.url.query) or DEFAULT_QUERY)
+        validate_query_options(query_options, serializer)
+        if children_of is not None:
+            if not request.url.query:
+                query_options.limit = None
+            # children are stored on the shard of their parent
+            where = [children_of == pk]
+            if query_options.count is None:
+                run = read(get_all(query_options, serializer, where), shard_engine(pk))
+            else:
+                # the statistics describe the whole table, the children of one
+                # row are counted exactly through the parent index
+                query_options.count = CountMode.EXACT
+                run = counted_read(query_options, serializer, where, shard_engine(pk))
+        else:
+            run = read(get_one(query_options, serializer, pk), shard_engine(pk))
+        content = await cancellable_read(request, run, query_deadline_ms)
+        headers = None
+        if query_options.count is not None:
+            content, total = content
+            headers = {TOTAL_COUNT_HEADER: str(total)}
+        if content is None:
+            raise HTTPException(status_code=404)
+        return Response(
+            content=content, media_type="application/json", headers=headers
+        )
+
+    @router.post("/")
+    async def create(body: input_model):
+        values = body.model_dump()
+        shard = insert_shard(table, values)
+        row = await _write(insert_stmts[shard], values, shard)
+        return ORJSONResponse(dict(row._mapping))
+
+    @router.put("/{pk}")
+    async def replace(pk: Annotated[int, Path(ge=0)], body: input_model):
+        values = body.model_dump()
+        check_update_shard(table, pk, values)
+        row = await _write(update_stmt, {"pk": pk, **values}, shard_for_id(pk))
+        if row is None:
+            raise HTTPException(status_code=404)
+        return ORJSONResponse(dict(row._mapping))
+
+    @router.patch("/{pk}")
+    async def update_partly(pk: Annotated[int, Path(ge=0)], body: partial_model):
+        values = body.model_dump(exclude_unset=True)
+        if not values:
+            raise HTTPException(status_code=422, detail="Nothing to update")
+        check_update_shard(table, pk, values)
+        row = await _write(update_stmt, {"pk": pk, **values}, shard_for_id(pk))
+        if row is None:
+            raise HTTPException(status_code=404)
+        return ORJSONResponse(dict(row._mapping))
+
+    @router.delete("/{pk}", status_code=204)
+    async def remove(pk: Annotated[int, Path(ge=0)]):
+        if await _write(delete_stmt, {"pk": pk}, shard_for_id(pk)) is None:
+            raise HTTPException(status_code=404)
+        return Response(status_code=204)
+
+    return router
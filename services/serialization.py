@@ -13,9 +13,32 @@ class RelationField(SerializerField):
     ...
 
 
+class AggregateField(SerializerField):
+    # value of `function` over a one-to-many relation, materialized in the
+    # serializer's side table (see services.aggregates)
+    def __init__(
+        self,
+        field: str,
+        alias: str | None,
+        relation: str,
+        function: str,
+        target: str = "id",
+        type_: Any = None,
+    ):
+        super().__init__(field, alias)
+        self.relation = relation
+        self.function = function
+        self.target = target
+        self.type_ = type_
+
+
 class BaseSerializer:
     model: Any
     fields: list[SerializerField]
+    # model columns indexed by FTS5 for the `match` filter operator
+    search_fields: list[str] = []
+    # model columns kept in memory by services.columnar for list queries
+    snapshot_fields: list[str] = []
 
     @classmethod
     def get_model_inspection(cls):
@@ -23,12 +46,25 @@ class BaseSerializer:
 
     def __init_subclass__(cls, **kwargs):
         __serializers__[cls.model] = cls
+        if cls.get_aggregate_fields():
+            from services.aggregates import aggregate_table
+
+            # registered on Base.metadata so create_all builds the side table
+            aggregate_table(cls)
+
+    @classmethod
+    def get_aggregate_fields(cls) -> list[AggregateField]:
+        return [f for f in cls.fields if isinstance(f, AggregateField)]
 
     @classmethod
     def get_field(cls, field):
         for serializer_field in cls.fields:
             if serializer_field.field == field or serializer_field.alias == field:
-                return cls.model.__dict__[field]
+                if isinstance(serializer_field, AggregateField):
+                    from services.aggregates import aggregate_table
+
+                    return aggregate_table(cls).c[serializer_field.field]
+                return cls.model.__dict__[serializer_field.field]
         return None
 
 
@@ -0,0 +1,241 @@
+import asyncio
+import functools
+import itertools
+import operator
+import os
+import pathlib
+from typing import Callable, Type
+
+from sqlalchemy import Result, create_engine, func, insert, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import InstrumentedAttribute, RelationshipDirection
+
+from services.cancellation import execute_interruptible, read
+from services.counting import count_statement, estimate_total, page_total
+from services.db_services import DATABASE_URL, engine
+from services.error import ValidationException
+from services.query_parse import get_all, get_merge_rows
+from services.query_parser import (
+    ActionTree,
+    CountMode,
+    FilterAction,
+    NestedField,
+    SortOrder,
+)
+from services.serialization import BaseSerializer, get_prop_serializer
+
+# With SHARD_COUNT > 1 ToDo roots are spread over that many SQLite files next
+# to DATABASE_URL (ToDoDB.shard0.db, ...), their slaves and slave details are
+# stored with them. Ids encode the shard, every row of shard k has
+# (id - 1) % SHARD_COUNT == k, so anything addressed by id or by its parent id
+# goes to a single file and list queries fan out to all files that can match.
+SHARD_COUNT = int(os.environ.get("SHARD_COUNT", "1"))
+
+
+def _shard_url(index: int):
+    url = make_url(DATABASE_URL)
+    path = pathlib.PurePath(url.database)
+    return url.set(
+        database=str(path.with_name(f"{path.stem}.shard{index}{path.suffix}"))
+    )
+
+
+if SHARD_COUNT == 1:
+    shard_engines = [engine]
+else:
+    shard_engines = [
+        create_engine(
+            _shard_url(index),
+            connect_args={"check_same_thread": False},
+            echo=engine.echo,
+        )
+        for index in range(SHARD_COUNT)
+    ]
+
+# new roots are placed round robin
+_root_shards = itertools.count()
+
+
+def shard_for_id(pk: int) -> int:
+    return (pk - 1) % SHARD_COUNT
+
+
+def shard_engine(pk: int):
+    return shard_engines[shard_for_id(pk)]
+
+
+def _parent_column(table):
+    for column in table.c:
+        if column.foreign_keys:
+            return column
+    return None
+
+
+def insert_shard(table, values: dict) -> int:
+    parent_column = _parent_column(table)
+    if parent_column is not None and values.get(parent_column.name) is not None:
+        return shard_for_id(values[parent_column.name])
+    return next(_root_shards) % SHARD_COUNT
+
+
+def insert_statement(table, shard: int):
+    statement = insert(table)
+    if SHARD_COUNT > 1:
+        # next id of the shard, allocated by the insert under the write lock
+        statement = statement.values(
+            id=select(
+                func.coalesce(func.max(table.c.id), shard + 1 - SHARD_COUNT)
+                + SHARD_COUNT
+            ).scalar_subquery()
+        )
+    return statement.returning(*table.c)
+
+
+def check_update_shard(table, pk: int, values: dict):
+    parent_column = _parent_column(table)
+    if (
+        SHARD_COUNT > 1
+        and parent_column is not None
+        and values.get(parent_column.name) is not None
+        and shard_for_id(values[parent_column.name]) != shard_for_id(pk)
+    ):
+        raise ValidationException(
+            f"{parent_column.name} must reference a row stored with this one"
+        )
+
+
+def _filter_ids(flt_item: FilterAction, serializer: Type[BaseSerializer]):
+    # ids a filter on the primary key of the row, or of a row it belongs to,
+    # can match; many-to-one relations never leave the shard
+    field = flt_item.field
+    while isinstance(field, NestedField):
+        relation = serializer.get_model_inspection().relationships.get(
+            field.fields[0]
+        )
+        if relation is None or relation.direction is not RelationshipDirection.MANYTOONE:
+            return None
+        serializer = get_prop_serializer(serializer.model, field.fields[0])
+        field = field.shift_down()
+    if serializer.get_field(field) is not serializer.model.id:
+        return None
+    if flt_item.operator is operator.eq:
+        values = [flt_item.value]
+    elif flt_item.operator is InstrumentedAttribute.in_:
+        values = flt_item.value
+    else:
+        return None
+    if not all(isinstance(value, int) for value in values):
+        return None
+    return values
+
+
+def prune_shards(qo: ActionTree, serializer: Type[BaseSerializer]) -> list[int]:
+    shards = set(range(SHARD_COUNT))
+    for flt_item in qo.filters:
+        ids = _filter_ids(flt_item, serializer)
+        if ids is not None:
+            shards &= {shard_for_id(pk) for pk in ids}
+    return sorted(shards)
+
+
+def merge_key(qo: ActionTree) -> Callable:
+    # same order as a single file: by the sort keys, NULLs first when
+    # ascending and last when descending, then by id
+    def compare(a, b) -> int:
+        for index, key in enumerate(qo.sort.keys if qo.sort else []):
+            x = a._mapping[f"sort_key_{index}"]
+            y = b._mapping[f"sort_key_{index}"]
+            if x == y:
+                continue
+            less = y is not None and (x is None or x < y)
+            return (-1 if less else 1) * (-1 if key.order is SortOrder.DESC else 1)
+        return (a.row_id > b.row_id) - (a.row_id < b.row_id)
+
+    return functools.cmp_to_key(compare)
+
+
+def _merge(rows: list, qo: ActionTree, offset: int, limit) -> list:
+    rows.sort(key=merge_key(qo))
+    return rows[offset : offset + limit if limit else None]
+
+
+def counted_read(
+    qo: ActionTree, serializer: Type[BaseSerializer], where=(), bind=None
+) -> Callable:
+    # a read of one file returning the JSON array and the total
+    bind = bind or engine
+    if qo.count is CountMode.ESTIMATE or qo.offset:
+        fallback = count_statement(qo, serializer, where=where)
+    statement = get_all(qo, serializer, where=where)
+
+    async def _run(abort):
+        row = await execute_interruptible(bind, statement, abort, Result.one)
+        if qo.count is CountMode.EXACT:
+            total = row.total_count
+            if total is None and qo.offset:
+                total = await execute_interruptible(bind, fallback, abort)
+            return row[0], total or 0
+        total = page_total(
+            qo.offset,
+            qo.limit,
+            row.page_rows,
+            lambda: estimate_total(bind, qo, serializer),
+        )
+        if total is None:
+            total = await execute_interruptible(bind, fallback, abort)
+        return row[0], total or 0
+
+    return _run
+
+
+def list_read(qo: ActionTree, serializer: Type[BaseSerializer]) -> Callable:
+    # returns the JSON array, with .count(...) a tuple of it and the total
+    if SHARD_COUNT == 1:
+        if qo.count is not None:
+            return counted_read(qo, serializer)
+        return read(get_all(qo, serializer))
+    # every shard returns its first offset + limit rows, the page is cut
+    # from the merged result
+    shards = prune_shards(qo, serializer)
+    offset, limit = qo.offset, qo.limit
+    qo.offset = 0
+    if limit:
+        qo.limit = offset + limit
+    if qo.count is CountMode.ESTIMATE:
+        fallback = count_statement(qo, serializer)
+    statement = get_merge_rows(qo, serializer)
+
+    def _estimate():
+        estimates = [
+            estimate_total(shard_engines[shard], qo, serializer) for shard in shards
+        ]
+        return None if None in estimates else sum(estimates)
+
+    async def _run(abort):
+        results = await asyncio.gather(
+            *(
+                execute_interruptible(
+                    shard_engines[shard], statement, abort, Result.all
+                )
+                for shard in shards
+            )
+        )
+        rows = _merge(list(itertools.chain(*results)), qo, offset, limit)
+        content = "[" + ",".join(row.sql_rest for row in rows) + "]"
+        if qo.count is None:
+            return content
+        if qo.count is CountMode.EXACT:
+            # every shard with matches returns rows, each carries its total
+            return content, sum(result[0].total_count for result in results if result)
+        total = page_total(offset, limit, len(rows), _estimate)
+        if total is None:
+            totals = await asyncio.gather(
+                *(
+                    execute_interruptible(shard_engines[shard], fallback, abort)
+                    for shard in shards
+                )
+            )
+            total = sum(shard_total or 0 for shard_total in totals)
+        return content, total
+
+    return _run
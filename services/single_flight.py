@@ -0,0 +1,144 @@
+import asyncio
+import os
+import threading
+import time
+from typing import Callable, Hashable, Type
+
+from starlette.requests import Request
+
+from services.cancellation import (
+    cancellable_read,
+    request_timeout,
+    start_query,
+    wait_for_query,
+)
+from services.query_parser import ActionTree, NestedField
+from services.serialization import BaseSerializer
+
+# Identical list queries arriving while one of them is still running wait for
+# that execution and get the same bytes; nothing is kept once it finished.
+SINGLE_FLIGHT_ENABLED = os.environ.get("SINGLE_FLIGHT_ENABLED", "1") == "1"
+
+
+def query_key(qo: ActionTree) -> Hashable:
+    # must be taken before compiling, _json_query pushes nested filters down
+    def _field(field):
+        return tuple(field.fields) if isinstance(field, NestedField) else field
+
+    return (
+        # output columns follow the serializer, not the order they were asked in
+        tuple(sorted(set(qo.select))) if qo.select is not None else None,
+        tuple(
+            (
+                _field(f.field),
+                getattr(f.operator, "__qualname__", repr(f.operator)),
+                repr(f.value),
+            )
+            for f in qo.filters
+        ),
+        tuple((_field(key.field), key.order) for key in qo.sort.keys)
+        if qo.sort is not None
+        else None,
+        repr(qo.limit),
+        repr(qo.offset),
+        qo.count,
+        tuple((name, query_key(relation)) for name, relation in qo.relations.items()),
+    )
+
+
+class _Flight:
+    def __init__(self, query: asyncio.Future, cancelled: threading.Event):
+        self.query = query
+        self.cancelled = cancelled
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self):
+        self._flights: dict[Hashable, _Flight] = {}
+        self.requests = 0
+        self.executions = 0
+        self.errors = 0
+
+    @property
+    def coalescing_ratio(self) -> float:
+        return self.requests / self.executions if self.executions else 0.0
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "executions": self.executions,
+            "errors": self.errors,
+            "in_flight": len(self._flights),
+            "coalescing_ratio": round(self.coalescing_ratio, 3),
+        }
+
+    def _start(self, key: Hashable, run: Callable, deadline: float) -> _Flight:
+        cancelled = threading.Event()
+        flight = _Flight(start_query(run, deadline, cancelled), cancelled)
+        self._flights[key] = flight
+        self.executions += 1
+
+        def _done(query: asyncio.Future):
+            self._forget(key, flight)
+            if query.cancelled():
+                return
+            # retrieved even when nobody waits for it any more, abandoned
+            # by every waiter is not counted as a failure
+            if query.exception() is not None and not flight.cancelled.is_set():
+                self.errors += 1
+
+        flight.query.add_done_callback(_done)
+        return flight
+
+    def _forget(self, key: Hashable, flight: _Flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    async def read(
+        self,
+        key: Hashable,
+        request: Request,
+        build_read: Callable,
+        deadline_ms: int,
+    ):
+        # every waiter keeps its own deadline, the shared statement runs until
+        # the route deadline or until the last waiter left
+        deadline = time.monotonic() + request_timeout(request, deadline_ms)
+        self.requests += 1
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._start(
+                key, build_read(), time.monotonic() + deadline_ms / 1000
+            )
+        flight.waiters += 1
+        try:
+            await wait_for_query(request, flight.query, deadline)
+        except BaseException:
+            flight.waiters -= 1
+            if flight.waiters == 0:
+                flight.cancelled.set()
+                self._forget(key, flight)
+                # respond once SQLite stopped and the connection is back in
+                # the pool, as cancellable_read does
+                await asyncio.wait({flight.query})
+            raise
+        flight.waiters -= 1
+        return flight.query.result()
+
+
+single_flight = SingleFlight()
+
+
+async def coalesced_read(
+    request: Request,
+    serializer: Type[BaseSerializer],
+    query_options: ActionTree,
+    build_read: Callable,
+    deadline_ms: int,
+):
+    if not SINGLE_FLIGHT_ENABLED:
+        return await cancellable_read(request, build_read(), deadline_ms)
+    return await single_flight.read(
+        (serializer, query_key(query_options)), request, build_read, deadline_ms
+    )
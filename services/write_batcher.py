@@ -0,0 +1,126 @@
+import asyncio
+import os
+
+from sqlalchemy import create_engine, event
+
+# Group commit for single-row writes, disabled unless WRITE_BATCH_ENABLED=1.
+# Mutations queued by concurrent requests are flushed together in one
+# transaction when WRITE_BATCH_SIZE items are waiting or WRITE_BATCH_DELAY_MS
+# has passed since the first one; every item runs in its own SAVEPOINT so a
+# failing statement only fails its own request.
+WRITE_BATCH_ENABLED = os.environ.get("WRITE_BATCH_ENABLED", "0") == "1"
+WRITE_BATCH_SIZE = int(os.environ.get("WRITE_BATCH_SIZE", "64"))
+WRITE_BATCH_DELAY_MS = float(os.environ.get("WRITE_BATCH_DELAY_MS", "5"))
+# PRAGMA synchronous of the batch connection: FULL, NORMAL or OFF
+WRITE_BATCH_SYNCHRONOUS = os.environ.get("WRITE_BATCH_SYNCHRONOUS", "FULL")
+
+
+class WriteBatcher:
+    def __init__(
+        self,
+        url,
+        max_batch: int = WRITE_BATCH_SIZE,
+        max_delay: float = WRITE_BATCH_DELAY_MS / 1000,
+        synchronous: str = WRITE_BATCH_SYNCHRONOUS,
+    ):
+        if synchronous.upper() not in ("FULL", "NORMAL", "OFF"):
+            raise ValueError(f"Unknown synchronous mode: {synchronous}")
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.batches = 0
+        self.items = 0
+        self._queue: asyncio.Queue | None = None
+        self._task: asyncio.Task | None = None
+        self._engine = create_engine(
+            url, connect_args={"check_same_thread": False}, pool_size=1
+        )
+
+        # pysqlite does not emit BEGIN itself in a way that SAVEPOINT works
+        # with, so the transaction is started explicitly
+        @event.listens_for(self._engine, "connect")
+        def _on_connect(dbapi_connection, _record):
+            dbapi_connection.isolation_level = None
+            dbapi_connection.execute(f"PRAGMA synchronous = {synchronous.upper()}")
+
+        @event.listens_for(self._engine, "begin")
+        def _on_begin(connection):
+            connection.exec_driver_sql("BEGIN IMMEDIATE")
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        # let the queued writes through before shutting down
+        await self._queue.join()
+        self._task.cancel()
+        self._task = None
+        self._engine.dispose()
+
+    async def execute(self, statement, params: dict):
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((statement, params, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            results = await asyncio.to_thread(self._flush, batch)
+            self.batches += 1
+            self.items += len(batch)
+            for (_, _, future), result in zip(batch, results):
+                if not future.done():
+                    if isinstance(result, Exception):
+                        future.set_exception(result)
+                    else:
+                        future.set_result(result)
+                self._queue.task_done()
+
+    def _flush(self, batch) -> list:
+        results = []
+        try:
+            with self._engine.begin() as connection:
+                for statement, params, _ in batch:
+                    try:
+                        with connection.begin_nested():
+                            result = connection.execute(statement, params)
+                            results.append(result.first())
+                    except Exception as e:
+                        results.append(e)
+        except Exception as e:
+            # the commit itself failed, none of the writes were persisted
+            return [e] * len(batch)
+        return results
+
+
+# one per shard, keyed by shard index
+_write_batchers: dict[int, WriteBatcher] = {}
+
+
+def get_write_batcher(shard: int = 0) -> WriteBatcher | None:
+    return _write_batchers.get(shard)
+
+
+async def start_write_batcher(engines):
+    if WRITE_BATCH_ENABLED and not _write_batchers:
+        for shard, engine in enumerate(engines):
+            _write_batchers[shard] = WriteBatcher(engine.url)
+            await _write_batchers[shard].start()
+
+
+async def stop_write_batcher():
+    for write_batcher in _write_batchers.values():
+        await write_batcher.stop()
+    _write_batchers.clear()
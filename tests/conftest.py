@@ -0,0 +1,17 @@
+import os
+import pathlib
+import sys
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+# importing the app must not touch the checked-in ToDoDB.db
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("SQL_ECHO", "0")
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--update-plans",
+        action="store_true",
+        help="rewrite the query plan snapshots instead of comparing with them",
+    )
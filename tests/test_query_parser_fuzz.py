@@ -0,0 +1,142 @@
+import random
+
+import pytest
+
+from services.query_parser import (
+    ActionTree,
+    NestedField,
+    SortAction,
+    _FastParseError,
+    _FastParser,
+    parser,
+)
+
+# Differential fuzzing of the hand-written parser against the Lark grammar:
+# both must build the same ActionTree for every query Lark accepts, and the
+# hand-written parser must not reject a query Lark accepts.
+
+NAMES = ["id", "comment", "slaves", "todo", "q", "filter", "in", "asc", "like", "_x1"]
+OPERATORS = [
+    "=", ">", "<", ">=", "<=", "<=>", "in", "!=", "is_null", "like", "ilike", "match",
+]
+VALUES = [
+    "0", "5", "12.5", "1.", ".5", "1e3", "2.5E-2", "2024-01-31", "1-2-3",
+    '"x"', '""', r'"a\"b"', r'"a\\"', '"2024-01-01"', "-1", "'x'",
+    "[1]", "[1, 2.5,3]", '["a" ,"b"]', "[2024-01-01, 5]", "[]", "[1,]", "[[1]]",
+]
+PUNCTUATION = list("()[]=,.!*\"q ") + [
+    "filter", "limit", "order", "count", "asc", "exact", "in", "\n",
+]
+
+
+def _ws(rnd: random.Random) -> str:
+    return rnd.choice(["", "", "", " ", "  ", "\t", "\n"])
+
+
+def _tree(rnd: random.Random, depth: int) -> str:
+    fields = []
+    for _ in range(rnd.randint(1, 4)):
+        match rnd.randint(0, 5 if depth < 3 else 3):
+            case 0:
+                fields.append("*")
+            case 1:
+                fields.append("!" + _ws(rnd) + rnd.choice(NAMES))
+            case 2 | 3:
+                fields.append(rnd.choice(NAMES))
+            case _:
+                fields.append(rnd.choice(NAMES) + _ws(rnd) + _tree(rnd, depth + 1))
+    text = "(" + _ws(rnd) + f"{_ws(rnd)},{_ws(rnd)}".join(fields) + _ws(rnd) + ")"
+    methods = [
+        lambda: "filter({}{}{}{}{})".format(
+            ".".join(rnd.choice(NAMES) for _ in range(rnd.randint(1, 3))),
+            _ws(rnd) if rnd.random() < 0.5 else " ",
+            rnd.choice(OPERATORS),
+            _ws(rnd) if rnd.random() < 0.5 else " ",
+            rnd.choice(VALUES),
+        ),
+        lambda: f"offset({rnd.choice(['0', '3', '2.5'])})",
+        lambda: f"limit({_ws(rnd)}{rnd.choice(['1', '20', '1e2'])}{_ws(rnd)})",
+        lambda: "order({})".format(
+            f"{_ws(rnd)},{_ws(rnd)}".join(
+                ".".join(rnd.choice(NAMES) for _ in range(rnd.randint(1, 3)))
+                + f",{_ws(rnd)}{rnd.choice(['asc', 'desc'])}"
+                for _ in range(rnd.randint(1, 3))
+            )
+        ),
+        lambda: f"count({_ws(rnd)}{rnd.choice(['exact', 'estimate', 'asc', 'exactly'])})",
+    ]
+    for method in methods:
+        if rnd.random() < 0.4:
+            text += _ws(rnd) + "." + _ws(rnd) + method()
+    return text
+
+
+def _mutate(rnd: random.Random, text: str) -> str:
+    for _ in range(rnd.randint(1, 3)):
+        pos = rnd.randint(0, len(text))
+        match rnd.randint(0, 2):
+            case 0:
+                text = text[:pos] + text[pos + 1 :]
+            case 1:
+                text = text[:pos] + rnd.choice(PUNCTUATION) + text[pos:]
+            case _:
+                text = text[:pos] + rnd.choice(PUNCTUATION) + text[pos + 1 :]
+    return text
+
+
+def _query(rnd: random.Random) -> str:
+    query = _ws(rnd) + "q" + _ws(rnd) + "=" + _ws(rnd) + _tree(rnd, 0) + _ws(rnd)
+    if rnd.random() < 0.3:
+        query = _mutate(rnd, query)
+    return query
+
+
+def _state(tree: ActionTree):
+    def field(value):
+        return tuple(value.fields) if isinstance(value, NestedField) else str(value)
+
+    sort = tree.sort
+    return (
+        tree.name,
+        tree.select,
+        [(field(f.field), f.operator, type(f.value), f.value) for f in tree.filters],
+        [(field(key.field), key.order) for key in sort.keys]
+        if isinstance(sort, SortAction)
+        else None,
+        (type(tree.limit), tree.limit, tree.explicit_limit),
+        (type(tree.offset), tree.offset),
+        tree.count,
+        {name: _state(relation) for name, relation in tree.relations.items()},
+    )
+
+
+def _parse(parse, query: str):
+    try:
+        return _state(parse(query)), None
+    except Exception as e:
+        return None, e
+
+
+def fuzz(iterations: int, seed: int) -> list[str]:
+    rnd = random.Random(seed)
+    failures = []
+    for _ in range(iterations):
+        query = _query(rnd)
+        expected, lark_error = _parse(parser.parse, query)
+        actual, fast_error = _parse(lambda q: _FastParser(q).parse(), query)
+        if lark_error is None:
+            if fast_error is not None:
+                failures.append(f"{query!r}: rejected ({fast_error!r}), Lark accepts")
+            elif actual != expected:
+                failures.append(f"{query!r}: {actual} != {expected}")
+        elif fast_error is None:
+            failures.append(f"{query!r}: accepted, Lark rejects ({lark_error!r})")
+        elif not isinstance(fast_error, (_FastParseError, KeyError, ValueError)):
+            failures.append(f"{query!r}: unexpected {fast_error!r}")
+    return failures
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_fast_parser_matches_lark(seed):
+    failures = fuzz(5000, seed)
+    assert not failures, "\n".join(failures[:20])
@@ -0,0 +1,128 @@
+import difflib
+import json
+import pathlib
+import re
+from typing import Type
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.dialects import sqlite
+
+from services.aggregates import install_aggregates
+from services.db_services import Base
+from services.full_text import install_search_indexes
+from services.profiling import explain_query_plan
+from services.query_parse import get_all
+from services.query_parser import parse_query
+from services.query_validation import validate_query_options
+from services.serialization import BaseSerializer, __serializers__
+
+# EXPLAIN QUERY PLAN of every query in the catalog is compared with its
+# snapshot; rewrite the snapshots with pytest --update-plans
+PLANS_DIR = pathlib.Path(__file__).resolve().parent.parent / "query_plans"
+CATALOG_PATH = PLANS_DIR / "catalog.json"
+SNAPSHOTS_DIR = PLANS_DIR / "snapshots"
+CATALOG = json.loads(CATALOG_PATH.read_text())
+
+_SCAN_RE = re.compile(r"\bSCAN (\w+)")
+_SEARCH_RE = re.compile(r"\bSEARCH (\w+)")
+
+
+def compile_query(q: str, serializer: Type[BaseSerializer]):
+    query_options = parse_query(q)
+    validate_query_options(query_options, serializer)
+    return get_all(query_options, serializer).compile(
+        dialect=sqlite.dialect(), compile_kwargs={"render_postcompile": True}
+    )
+
+
+def find_regressions(old: list[str], new: list[str]) -> list[str]:
+    regressions = []
+    old_search = {m.group(1) for line in old for m in _SEARCH_RE.finditer(line)}
+    old_scan = {m.group(1) for line in old for m in _SCAN_RE.finditer(line)}
+    for table in {m.group(1) for line in new for m in _SCAN_RE.finditer(line)}:
+        if table in old_search and table not in old_scan:
+            regressions.append(f"{table}: index search turned into full scan")
+    old_materialized = sum("MATERIALIZE" in line for line in old)
+    new_materialized = sum("MATERIALIZE" in line for line in new)
+    if new_materialized > old_materialized:
+        regressions.append(
+            f"materialized subqueries: {old_materialized} -> {new_materialized}"
+        )
+    return regressions
+
+
+def run_query(connection, compiled):
+    # errors raised only while the statement runs, such as FTS5 query syntax
+    params = compiled.construct_params()
+    positional = tuple(params[name] for name in compiled.positiontup)
+    connection.exec_driver_sql(str(compiled), positional).all()
+
+
+@pytest.fixture(scope="module")
+def serializers():
+    # the views register every serializer as a side effect of their import
+    import main  # noqa: F401
+
+    return {
+        serializer.model.__tablename__: serializer
+        for serializer in __serializers__.values()
+    }
+
+
+@pytest.fixture(scope="module")
+def connection(serializers):
+    # plans depend on schema and indexes only, not on the rows in ToDoDB.db
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    install_search_indexes(engine)
+    install_aggregates(engine)
+    with engine.connect() as connection:
+        yield connection
+
+
+@pytest.fixture(scope="module")
+def snapshots(request):
+    update = request.config.getoption("--update-plans")
+    snapshots = {}
+    for table in CATALOG:
+        path = SNAPSHOTS_DIR / f"{table}.json"
+        snapshots[table] = json.loads(path.read_text()) if path.exists() else {}
+    yield snapshots
+    if update:
+        SNAPSHOTS_DIR.mkdir(parents=True, exist_ok=True)
+        for table, queries in CATALOG.items():
+            # queries no longer in the catalog are dropped
+            plans = {q: snapshots[table][q] for q in queries if q in snapshots[table]}
+            (SNAPSHOTS_DIR / f"{table}.json").write_text(
+                json.dumps(plans, indent=2) + "\n"
+            )
+
+
+@pytest.mark.parametrize(
+    "table, q", [(table, q) for table, queries in CATALOG.items() for q in queries]
+)
+def test_query_plan(table, q, serializers, connection, snapshots, request):
+    if table not in serializers:
+        raise KeyError(f"No serializer registered for table: {table}")
+    compiled = compile_query(q, serializers[table])
+    run_query(connection, compiled)
+    plan = explain_query_plan(connection, compiled)
+    if request.config.getoption("--update-plans"):
+        snapshots[table][q] = plan
+        return
+    if q not in snapshots[table]:
+        pytest.fail(f"[{table}] {q}: no snapshot, run with --update-plans")
+    if snapshots[table][q] == plan:
+        return
+    regressions = find_regressions(snapshots[table][q], plan)
+    kind = "REGRESSION" if regressions else "CHANGED"
+    lines = [f"[{table}] {kind} {q}"]
+    lines += [f"    ! {regression}" for regression in regressions]
+    lines += [
+        "    " + line
+        for line in difflib.unified_diff(
+            snapshots[table][q], plan, "snapshot", "current", lineterm=""
+        )
+    ]
+    pytest.fail("\n".join(lines))
@@ -1,4 +1,11 @@
-from services.serialization import BaseSerializer, SerializerField
+from sqlalchemy import DateTime
+
+from services.serialization import (
+    BaseSerializer,
+    SerializerField,
+    RelationField,
+    AggregateField,
+)
 from todo.model import ToDo
 
 
@@ -7,10 +14,22 @@ class ToDoSerializer(BaseSerializer):
     fields = [
         SerializerField("id", "primary_key"),
         SerializerField("comment", "instruction"),
-        SerializerField("crated_at", "creation_time"),
+        SerializerField("created_at", "creation_time"),
         SerializerField("priority", "preference"),
-        SerializerField("is main", "is_principal)"),
+        SerializerField("is_main", "is_principal"),
         SerializerField("worker_fullname", "worker"),
         SerializerField("due_date", "deadline"),
         SerializerField("count", "amount"),
+        RelationField("slaves", "slaves"),
+        AggregateField("slave_count", "slave_count", "slaves", "count"),
+        AggregateField(
+            "last_slave_at",
+            "last_slave_at",
+            "slaves",
+            "max",
+            target="created_at",
+            type_=DateTime(timezone=True),
+        ),
     ]
+    search_fields = ["comment", "worker_fullname"]
+    snapshot_fields = ["priority", "is_main", "worker_fullname", "due_date", "count"]
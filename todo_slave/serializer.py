@@ -11,3 +11,4 @@ class ToDoSlaveSerializer(BaseSerializer):
         RelationField("todo", "todo"),
         RelationField("slavedetails", "slavedetails"),
     ]
+    search_fields = ["comment"]
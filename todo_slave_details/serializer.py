@@ -8,3 +8,4 @@ class ToDoSlaveDetailsSerializer(BaseSerializer):
         SerializerField("id", "primary_key"),
         SerializerField("details", "info"),
     ]
+    search_fields = ["details"]